@@ -1,68 +1,335 @@
 from PyQt6 import uic
-from PyQt6.QtCore import Qt, QSize
-from PyQt6.QtGui import QPixmap, QImage, QIcon, QKeyEvent
-from PyQt6.QtWidgets import QApplication, QMainWindow, QMessageBox
-from dataclasses import dataclass
+from PyQt6.QtCore import (Qt, QSize, QTimer, QPointF, QRectF, QObject, pyqtSignal, pyqtSlot, QByteArray, QBuffer,
+                          QIODevice, QStringListModel)
+from PyQt6.QtGui import (QPixmap, QImage, QImageReader, QIcon, QKeyEvent, QPainter, QPainterPath, QPen, QPolygonF,
+                         QResizeEvent, QColor)
+from PyQt6.QtWidgets import QApplication, QMainWindow, QMessageBox, QWidget, QCompleter, QListWidgetItem
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import asdict
+from functools import partial
+from typing import Callable
 from dotenv import load_dotenv
-import requests
+import math
 import sys
-import os
+import time
 
+from disk_cache import DiskCache
+from gazetteer import open_gazetteer
+from heatmap import BIN_BITS, open_heatmap
+from geo_cache import QuantizedCache
+from history import HistoryEntry, NavigationHistory
+from http_cache import HttpCache
+from map_cache import MapCache
+from map_client import (AddressDetails, GEOCODER_API_SERVER, MapClient, NothingFound, Organisation, Place,
+                        SEARCH_API_SERVER, SEARCH_PAGE_SIZE)
+from map_source import open_map_source
+from measure import format_area, format_distance, path_length, polygon_area
+from point_layer import open_point_layer
+from projection import offset, to_pixels, world_size
+from reverse_geocoder import open_reverse_geocoder
+from scheduler import Priority, RequestScheduler, host_of
+from session import Session, load_session, save_session
+from stall_watchdog import StallWatchdog
+from suggest import PrefixCache
+from tracks import open_tracks
+from view_key import ViewKey
+from viewport import Viewport
 
-@dataclass
-class Map:
-    latitude: float
-    longitude: float
-    zoom: int
-    theme: bool
-    point: str
 
-    def __eq__(self, values_tuple):
-        return (self.latitude, self.longitude, self.zoom, self.theme) == values_tuple
+PREVIEW_SIZE = QSize(64, 48)
+PREVIEW_ZOOM = 15
+MARKER_COLOR = QColor('#1e98ff')
+POINT_COLOR = QColor('#f0503c')
+TRACK_COLOR = QColor('#7b3fe4')
+TRACK_PIECE = 64
+MEASURE_COLOR = QColor('#e2393a')
+MEASURE_FILL = QColor(226, 57, 58, 50)
+PAN_STEPS = {Qt.Key.Key_Left: (0, -180), Qt.Key.Key_Right: (0, 180), Qt.Key.Key_Up: (90, 0), Qt.Key.Key_Down: (-90, 0)}
 
 
-@dataclass
-class AddressDetails:
-    address_line: str
-    postal_code: str
+def image_bytes(image: QImage, image_format: str = 'PNG', quality: int = -1) -> bytes:
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, image_format, quality)
+    return bytes(data)
 
-    def get_full(self):
-        return f'{self.address_line}, почтовый индекс: {self.postal_code}'
+
+def decode_image(data: bytes | memoryview, size: QSize = None) -> QImage:
+    # Slices of a mapped tile pack are copied into the QByteArray once, like bytes; the copy is small next to decoding.
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+    reader = QImageReader(buffer)
+    if size is not None and reader.size() != size:
+        reader.setScaledSize(size)
+    image = reader.read()
+    if image.isNull():
+        raise ValueError(reader.errorString())
+    return image
+
+
+def draw_marker(painter: QPainter, x: float, y: float, size: float = 1.0) -> None:
+    painter.save()
+    painter.translate(x, y)
+    painter.scale(size, size)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    path = QPainterPath(QPointF(0, 0))
+    path.cubicTo(-4, -10, -11, -16, -11, -26)
+    path.arcTo(QRectF(-11, -37, 22, 22), 180, -180)
+    path.cubicTo(11, -16, 4, -10, 0, 0)
+    painter.setPen(QPen(QColor('white'), 1.5))
+    painter.setBrush(MARKER_COLOR)
+    painter.drawPath(path)
+    painter.setPen(Qt.PenStyle.NoPen)
+    painter.setBrush(QColor('white'))
+    painter.drawEllipse(QPointF(0, -26), 4.5, 4.5)
+    painter.restore()
+
+
+def draw_heatmap(painter: QPainter, rgba, x: float, y: float) -> None:
+    height, width = rgba.shape[:2]
+    image = QImage(rgba.data, width, height, width * 4, QImage.Format.Format_RGBA8888)
+    painter.save()
+    painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+    painter.drawImage(QRectF(x, y, width << BIN_BITS, height << BIN_BITS), image)
+    painter.restore()
+
+
+def draw_measurement(painter: QPainter, points: list[tuple[float, float]]) -> None:
+    painter.save()
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    polygon = QPolygonF([QPointF(x, y) for x, y in points])
+    if len(polygon) > 2:
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(MEASURE_FILL)
+        painter.drawPolygon(polygon)
+    painter.setPen(QPen(MEASURE_COLOR, 2))
+    painter.drawPolyline(polygon)
+    painter.setBrush(QColor('white'))
+    for point in polygon:
+        painter.drawEllipse(point, 4, 4)
+    painter.restore()
+
+
+def draw_tracks(painter: QPainter, lines) -> None:
+    painter.save()
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    pen = QPen(TRACK_COLOR, 3)
+    pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+    pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
+    painter.setPen(pen)
+    for line in lines:
+        # Long self-crossing polylines are much slower to stroke than the same vertices in short pieces.
+        for start in range(0, len(line) - 1, TRACK_PIECE):
+            painter.drawPolyline(QPolygonF([QPointF(x, y) for x, y in line[start:start + TRACK_PIECE + 1].tolist()]))
+    painter.restore()
+
+
+def draw_points(painter: QPainter, xs, ys, counts) -> None:
+    painter.save()
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    single = counts == 1
+    points = QPolygonF([QPointF(x, y) for x, y in zip(xs[single].tolist(), ys[single].tolist())])
+    for color, width in ((QColor('white'), 8), (POINT_COLOR, 5)):
+        pen = QPen(color, width)
+        pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+        painter.setPen(pen)
+        painter.drawPoints(points)
+    font = painter.font()
+    font.setPixelSize(10)
+    font.setBold(True)
+    painter.setFont(font)
+    painter.setBrush(POINT_COLOR)
+    for x, y, count in zip(xs[~single].tolist(), ys[~single].tolist(), counts[~single].tolist()):
+        radius = 9 + 3 * math.log10(count)
+        painter.setPen(QPen(QColor('white'), 1.5))
+        painter.drawEllipse(QPointF(x, y), radius, radius)
+        painter.drawText(QRectF(x - radius, y - radius, 2 * radius, 2 * radius), Qt.AlignmentFlag.AlignCenter,
+                         str(count) if count < 1000 else f'{count // 1000}k')
+    painter.restore()
+
+
+class Dispatcher(QObject):
+    called = pyqtSignal(object)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.called.connect(self.call)
+
+    @pyqtSlot(object)
+    def call(self, callback: Callable) -> None:
+        callback()
 
 
 class Application(QMainWindow):
     def __init__(self) -> None:
         load_dotenv()
-        self.static_apikey = os.getenv('STATIC_APIKEY')
-        self.search_apikey = os.getenv('SEARCH_APIKEY')
-        self.geocode_apikey = os.getenv('GEOCODE_APIKEY')
+        gazetteer = open_gazetteer()
+        self.client = MapClient.from_env(gazetteer=gazetteer, http_cache=HttpCache(DiskCache('cache/http.sqlite3')))
+        self.map_source = open_map_source(self.client)
         super().__init__()
         uic.loadUi('src/maps4.ui', self)
-        self.setFixedSize(540, 690)
+        self.base_size = QSize(540, 690)
+        self.base_geometry = {widget: widget.geometry() for widget in self.centralWidget().findChildren(
+                              QWidget, options=Qt.FindChildOption.FindDirectChildrenOnly)
+                              if widget not in (self.image, self.info, self.results)}
+        self.setMinimumSize(self.base_size)
+        self.resize(self.base_size)
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(300)
+        self.resize_timer.timeout.connect(self.resize_map)
         self.image.setPixmap(QPixmap.fromImage(QImage('src/logo.png')))
         self.setWindowIcon(QIcon('src/icon.png'))
         self.info.setVisible(False) 
         self.clear.clicked.connect(self.clear_ui)
         self.getmap.clicked.connect(self.get_map)
         self.theme.clicked.connect(self.change_theme)
+        self.back.clicked.connect(self.go_back)
+        self.forward.clicked.connect(self.go_forward)
         self.index.clicked.connect(self.change_postal_code_visibility)
+        self.measure.toggled.connect(self.toggle_measure)
+        self.measure_points = []
         self.nightMode = False
         self.address_info = None
         self.current_map = None
+        self.base_image = None
+        self.marker = None
+        self.map_cache = MapCache()
+        self.decode_times = deque(maxlen=100)
+        self.pending_key = None
+        self.view_future = None
+        self.history = NavigationHistory()
+        self.address_cache = QuantizedCache()
+        self.organisation_cache = QuantizedCache()
+        self.scheduler = RequestScheduler()
+        self.dispatcher = Dispatcher()
+        self.watchdog = StallWatchdog(self.dispatcher.called.emit, ignore=('Dispatcher.call',))
+        self.watchdog.start()
+        self.suggestions = {}
+        self.suggest_future = None
+        self.suggest_cache = PrefixCache(limit=5, text_of=Place.get_title)
+        self.suggest_model = QStringListModel(self)
+        self.completer = QCompleter(self.suggest_model, self)
+        self.completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self.completer.activated.connect(self.pick_suggestion)
+        self.address.setCompleter(self.completer)
+        self.suggest_timer = QTimer(self)
+        self.suggest_timer.setSingleShot(True)
+        self.suggest_timer.setInterval(250)
+        self.suggest_timer.timeout.connect(self.request_suggestions)
+        self.address.textEdited.connect(lambda _: self.suggest_timer.start())
+        self.search_text = None
+        self.search_generation = 0
+        self.search_results = []
+        self.search_exhausted = True
+        self.page_future = None
+        self.previews_requested = set()
+        self.preview_futures = []
+        self.results.setVisible(False)
+        self.results.setIconSize(PREVIEW_SIZE)
+        self.results.setWordWrap(True)
+        self.results.itemClicked.connect(self.pick_result)
+        self.results.verticalScrollBar().valueChanged.connect(self.results_scrolled)
+        self.point_layer = None
+        self.heatmap = None
+        self.tracks = None
+        self.run_request(Priority.BACKGROUND, '', self.point_layer_loaded, open_point_layer)
+        self.run_request(Priority.BACKGROUND, '', self.heatmap_loaded, open_heatmap)
+        self.run_request(Priority.BACKGROUND, '', self.tracks_loaded, open_tracks)
+        self.run_request(Priority.BACKGROUND, '', self.reverse_geocoder_loaded, open_reverse_geocoder, gazetteer)
+        self.run_request(Priority.BACKGROUND, '', partial(self.result_of, quiet=True), self.client.http_cache.purge)
+        self.restore_session()
+
+    def closeEvent(self, event) -> None:
+        self.watchdog.stop()
+        self.scheduler.shutdown()
+        self.save_session()
+        super().closeEvent(event)
+
+    def save_session(self) -> None:
+        image = None
+        if self.current_map and self.current_map.viewport:
+            cached = self.map_cache.get(self.current_map)
+            image = image_bytes(cached) if cached is not None else None
+        save_session(Session(map=self.current_map.to_dict() if self.current_map else None,
+                             address=asdict(self.address_info) if self.address_info else None,
+                             viewport=asdict(self.current_map.viewport) if image else None,
+                             window=(self.width(), self.height()), image=image, marker=self.marker))
+
+    def restore_session(self) -> None:
+        session = load_session()
+        if session is None:
+            return
+        if session.window:
+            self.resize(*session.window)
+        if not session.map:
+            return
+
+        if session.map['theme'] != self.nightMode:
+            self.nightMode = session.map['theme']
+            self.apply_theme()
+        key = ViewKey(**dict(session.map, point=None))
+        self.marker = session.marker
+        self.latitude.setText(str(key.latitude))
+        self.longitude.setText(str(key.longitude))
+        self.zoom.setValue(key.zoom)
+        if session.address:
+            self.address_info = AddressDetails(**session.address)
+            self.info.setText(self.address_info.address_line)
+            self.info.setVisible(True)
+        if session.image and session.viewport:
+            viewport = Viewport(**session.viewport)
+            image = QImage.fromData(session.image)
+            image.setDevicePixelRatio(viewport.scale)
+            self.map_cache.put(key.replace(viewport=viewport), image, image.sizeInBytes())
+            self.show_map(key.replace(viewport=viewport), image, encoded=session.image)
+        # Without a saved frame the view stays empty until the refetch, which must not clear it on failure.
+        QTimer.singleShot(0, partial(self.revalidate_map, key))
 
+    def revalidate_map(self, key: ViewKey) -> None:
+        if self.pending_key:
+            return
+        key = key.replace(viewport=Viewport.from_widget(self.image))
+        self.request_view(key, self.map_source.url, partial(self.map_loaded, key, quiet=True), self.load_map_image, key)
+
+    def resizeEvent(self, event: QResizeEvent) -> None:
+        dx = (self.width() - self.base_size.width()) // 2
+        dy = self.height() - self.base_size.height()
+        self.image.setGeometry(45, 10, self.width() - 90, 450 + dy)
+        for widget, geometry in self.base_geometry.items():
+            widget.setGeometry(geometry.translated(dx, dy))
+        self.info.setGeometry(45, self.image.geometry().bottom() - 40, self.image.width(), 41)
+        self.results.setGeometry(45, 10, 220, self.image.height() - 41)
+        self.resize_timer.start()
+        super().resizeEvent(event)
+
+    def resize_map(self) -> None:
+        if self.current_map and Viewport.from_widget(self.image) != self.current_map.viewport:
+            self.get_map_by_cords(latitude=self.current_map.latitude, longitude=self.current_map.longitude, quiet=True)
 
     def change_theme(self) -> None:
         self.nightMode = not self.nightMode
+        self.apply_theme()
+        if self.current_map:
+            self.get_map_by_cords()
+
+    def apply_theme(self) -> None:
         icon, background = ('night.png', 'background_dark.jpg') if self.nightMode else ('day.png', 'background.jpg')
         logo, color = ('logo_dark.png', '#574e80') if self.nightMode else ('logo.png', '#e2393a')
+        checked = '#3a3359' if self.nightMode else '#9c1f20'
         self.setStyleSheet(f'QMainWindow {{background-image: url(src/{background});}}')
         self.getmap.setStyleSheet(f'background-color: {color}; color: white')
         self.clear.setStyleSheet(f'background-color: {color}; color: white')
+        self.back.setStyleSheet(f'background-color: {color}; color: white')
+        self.forward.setStyleSheet(f'background-color: {color}; color: white')
+        self.measure.setStyleSheet(f'QPushButton {{background-color: {color}; color: white}} '
+                                   f'QPushButton:checked {{background-color: {checked}}}')
         self.image.setPixmap(QPixmap.fromImage(QImage(f'src/{logo}')))
         self.theme.setIcon(QIcon(f'src/{icon}'))
         self.theme.setIconSize(QSize(50, 50))
-        if self.current_map:
-            self.get_map_by_cords()
 
     def change_postal_code_visibility(self) -> None:
         if not self.address_info:
@@ -73,7 +340,7 @@ class Application(QMainWindow):
         elif self.address_info.postal_code:
                 self.info.setText(self.address_info.get_full())
         else:
-            self.get_map_by_name(self.address_info.address_line)
+            self.request_postal_code(self.address_info)
 
     def clear_ui(self) -> None:
         self.image.setPixmap(QPixmap.fromImage(QImage('src/logo.png')))
@@ -83,7 +350,13 @@ class Application(QMainWindow):
         self.latitude.clear()
         self.zoom.setValue(12)
         self.current_map = None
+        self.base_image = None
+        self.marker = None
+        self.measure_points = []
+        self.measure.setChecked(False)
         self.address_info = None
+        self.cancel_view()
+        self.clear_results()
 
     def error_message(self, message: str) -> None:
         self.clear_ui()
@@ -92,8 +365,9 @@ class Application(QMainWindow):
         msgBox.setText(message)
         msgBox.exec()
     
-    def get_map_by_cords(self, latitude: float = None, longitude: float = None, new_point: bool = False) -> None:
-        if not (latitude and longitude):
+    def get_map_by_cords(self, latitude: float = None, longitude: float = None, new_point: bool = False,
+                         quiet: bool = False) -> None:
+        if latitude is None or longitude is None:
             latitude, longitude = self.latitude.text(), self.longitude.text()
             try:
                 latitude, longitude = float(latitude.replace(',', '.')), float(longitude.replace(',', '.'))
@@ -104,137 +378,524 @@ class Application(QMainWindow):
                 self.error_message(message='Некорректные значения ширины или долготы.')
                 return
             
-        point = f'{longitude},{latitude},vkbkm' if new_point else self.current_map.point
-        zoom = self.zoom.value()
+        key = ViewKey(latitude=latitude, longitude=longitude, zoom=self.zoom.value(), theme=self.nightMode,
+                      viewport=Viewport.from_widget(self.image))
+        if new_point:
+            self.marker = (key.latitude, key.longitude)
+        if key == self.pending_key:
+            return
+        if key == self.current_map and self.pending_key is None:
+            self.render_map()
+            return
+
+        image = self.map_cache.get(key)
+        if image is not None:
+            self.cancel_view()
+            self.show_map(key, image)
+            return
+
+        self.show_placeholder(key)
+        self.request_view(key, self.map_source.url, partial(self.map_loaded, key, quiet=quiet), self.load_map_image,
+                          key)
+
+    def request_view(self, key: ViewKey, url: str, callback: Callable, fn: Callable, *args) -> None:
+        # Only the newest view is worth loading; a superseded one that has not started yet is dropped.
+        self.cancel_view()
+        self.pending_key = key
+        self.view_future = self.run_request(Priority.VIEW, url, callback, fn, *args)
+
+    def cancel_view(self) -> None:
+        self.pending_key = None
+        if self.view_future is not None:
+            self.view_future.cancel()
+            self.view_future = None
+
+    def map_loaded(self, key: ViewKey, future: Future, quiet: bool = False) -> None:
+        if key != self.pending_key:
+            return
+        self.pending_key = None
+        frame = self.result_of(future, quiet=quiet)
+        if frame is None:
+            return
+        image, decode_time = frame
+        self.decode_times.append(decode_time)
+        self.map_cache.put(key, image, image.sizeInBytes())
+        self.show_map(key, image)
+        self.report_decode_time()
+        self.request_previews()
+
+    def show_map(self, key: ViewKey, image: QImage, remember: bool = True, encoded: bytes = None) -> None:
+        self.current_map = key
+        self.base_image = image
+        self.render_map()
+        self.image.setFocus()
+        if not remember or (self.history.current and self.history.current.state[0] == key):
+            return
+        # Encoding a large frame takes up to 100 ms, so it is done by the workers after the frame is shown;
+        # a cached view reuses the bytes it was stored with.
+        encoded = encoded or next((entry.image for entry in self.history.entries
+                                   if entry.state[0] == key and entry.image), None)
+        entry = self.history.push((key, self.marker, self.address_info), encoded or b'')
+        if not encoded:
+            self.run_request(Priority.USER, '', partial(self.history_encoded, entry), image_bytes, image, 'JPG', 85)
+
+    def history_encoded(self, entry: HistoryEntry, future: Future) -> None:
+        encoded = self.result_of(future, quiet=True)
+        if encoded is not None:
+            self.history.set_image(entry, encoded)
+
+    def render_map(self) -> None:
+        image = self.base_image
+        if image is None:
+            return
+        if self.marker or self.point_layer or self.heatmap or self.tracks or self.measure_points:
+            image = image.copy()
+            painter = QPainter(image)
+            if self.heatmap is not None:
+                heat = self.heatmap.render(self.current_map.zoom, *self.view_bounds())
+                if heat is not None:
+                    draw_heatmap(painter, *heat)
+            if self.tracks is not None:
+                draw_tracks(painter, self.tracks.visible(self.current_map.zoom, *self.view_bounds()))
+            if self.point_layer is not None:
+                draw_points(painter, *self.point_layer.visible(self.current_map.zoom, *self.view_bounds()))
+            if self.measure_points:
+                draw_measurement(painter, [self.screen_position(*point) for point in self.measure_points])
+            if self.marker is not None:
+                draw_marker(painter, *self.screen_position(*self.marker))
+            painter.end()
+        self.image.setPixmap(QPixmap.fromImage(image))
+
+    def view_bounds(self) -> tuple[float, float, int, int]:
+        key = self.current_map
+        x, y = to_pixels(key.center[1], key.center[0], key.zoom)
+        width, height = key.viewport.width, key.viewport.height
+        return x - width / 2, y - height / 2, width, height
 
-        if self.current_map == (latitude, longitude, zoom, self.nightMode):
+    def point_layer_loaded(self, future: Future) -> None:
+        point_layer = self.result_of(future, quiet=True)
+        if not point_layer:
             return
+        self.point_layer = point_layer
+        self.statusbar.showMessage(f'точек на карте: {len(point_layer)}', 5000)
+        if self.base_image is not None:
+            self.render_map()
 
-        map_params = {
-            "apikey": self.static_apikey,
-            "ll": f'{longitude},{latitude}',
-            "z": zoom,
-            "size": '450,450',
-            "pt": point,
-            "theme": 'dark' if self.nightMode else 'light'
-        }
-
-        map_api_server = "https://static-maps.yandex.ru/v1"
-        response = requests.get(map_api_server, params=map_params)
-        if response.ok:
-            with open('res.jpg', 'wb') as file:
-                file.write(response.content)
-            self.image.setPixmap(QPixmap.fromImage(QImage('res.jpg')))
+    def heatmap_loaded(self, future: Future) -> None:
+        heatmap = self.result_of(future, quiet=True)
+        if not heatmap:
+            return
+        self.heatmap = heatmap
+        self.statusbar.showMessage(f'точек тепловой карты: {len(heatmap)}', 5000)
+        if self.base_image is not None:
+            self.render_map()
+
+    def tracks_loaded(self, future: Future) -> None:
+        tracks = self.result_of(future, quiet=True)
+        if not tracks:
+            return
+        self.tracks = tracks
+        self.statusbar.showMessage(f'треков: {len(tracks.tracks)}, вершин: {len(tracks)}', 5000)
+        if self.base_image is not None:
+            self.render_map()
+
+    def reverse_geocoder_loaded(self, future: Future) -> None:
+        # Until the index is built, addresses of clicked points come from the geocoder api.
+        self.client.reverse_geocoder = self.result_of(future, quiet=True)
+
+    def screen_position(self, latitude: float, longitude: float) -> tuple[float, float]:
+        key = self.current_map
+        x, y = to_pixels(longitude, latitude, key.zoom)
+        center_x, center_y = to_pixels(key.center[1], key.center[0], key.zoom)
+        world = world_size(key.zoom)
+        dx = (x - center_x + world / 2) % world - world / 2
+        return key.viewport.width / 2 + dx, key.viewport.height / 2 + y - center_y
+
+    def toggle_measure(self, checked: bool) -> None:
+        self.measure_points = []
+        self.report_measure()
+        if self.base_image is not None:
+            self.render_map()
             self.image.setFocus()
-            os.remove('res.jpg')
-            self.current_map = Map(latitude=latitude, longitude=longitude, zoom=zoom, theme=self.nightMode, point=point)
+
+    def report_measure(self) -> None:
+        if not self.measure.isChecked():
+            self.statusbar.clearMessage()
+        elif not self.measure_points:
+            self.statusbar.showMessage('линейка: щёлкните по карте, чтобы добавить точку')
+        else:
+            latitudes, longitudes = zip(*self.measure_points)
+            message = f'расстояние: {format_distance(path_length(latitudes, longitudes))}'
+            if len(self.measure_points) > 2:
+                message += f', площадь: {format_area(polygon_area(latitudes, longitudes))}'
+            self.statusbar.showMessage(message)
+
+    def go_back(self) -> None:
+        self.restore_entry(self.history.back())
+
+    def go_forward(self) -> None:
+        self.restore_entry(self.history.forward())
+
+    def restore_entry(self, entry: HistoryEntry | None) -> None:
+        if entry is None:
+            return
+        key, marker, address_info = entry.state
+        callback = partial(self.entry_loaded, key, marker, address_info)
+        if entry.image:
+            size = QSize(key.viewport.pixel_width, key.viewport.pixel_height)
+            self.request_view(key, '', callback, decode_image, entry.image, size)
+        else:
+            # The frame is still being encoded, so it is loaded again like any other view.
+            self.request_view(key, self.map_source.url, callback, self.load_frame, key)
+
+    def entry_loaded(self, key: ViewKey, marker: tuple[float, float] | None, address_info: AddressDetails | None,
+                     future: Future) -> None:
+        if key != self.pending_key:
+            return
+        self.pending_key = None
+        image = self.result_of(future, quiet=True)
+        if image is None:
+            return
+        image.setDevicePixelRatio(key.viewport.scale)
+        if key.theme != self.nightMode:
+            self.nightMode = key.theme
+            self.apply_theme()
+        self.latitude.setText(str(key.latitude))
+        self.longitude.setText(str(key.longitude))
+        self.zoom.setValue(key.zoom)
+        self.address_info = address_info
+        self.info.setText(address_info.address_line if address_info else '')
+        self.info.setVisible(address_info is not None)
+        self.marker = marker
+        self.show_map(key, image, remember=False)
+        self.resize_map()
+
+    def run_request(self, priority: Priority, url: str, callback: Callable, fn: Callable, *args) -> Future:
+        future = self.scheduler.submit(priority, host_of(url), fn, *args)
+        future.add_done_callback(lambda done: self.dispatcher.called.emit(partial(callback, done)))
+        return future
+
+    def result_of(self, future: Future, quiet: bool = False):
+        if future.cancelled():
+            return None
+        error = future.exception()
+        if error is None:
+            return future.result()
+        if quiet:
+            return None
+        if isinstance(error, NothingFound):
+            self.error_message(message='Ошибка при обработке ответа от api яндекс карт.\nВероятная причина - неверный адрес.')
         else:
             self.error_message(message='Ошибка при выполнении запроса к api яндекс карт.')
-            
+        return None
+
+    def load_frame(self, key: ViewKey) -> QImage:
+        return self.load_map_image(key)[0]
+
+    def load_map_image(self, key: ViewKey) -> tuple[QImage, float]:
+        viewport = key.viewport
+        decode_time = 0.0
+        image = QImage(viewport.pixel_width, viewport.pixel_height, QImage.Format.Format_RGB32)
+        image.setDevicePixelRatio(viewport.scale)
+        image.fill(QColor('#574e80' if key.theme else '#ededed'))
+        painter = QPainter(image)
+        try:
+            for piece in self.map_source.pieces(key, viewport):
+                size = QSize(round(piece.width * viewport.scale), round(piece.height * viewport.scale))
+                started = time.perf_counter()
+                tile = decode_image(piece.data, size)
+                decode_time += time.perf_counter() - started
+                painter.drawImage(QRectF(piece.x, piece.y, piece.width, piece.height), tile)
+        finally:
+            painter.end()
+        return image, decode_time
+
+    def show_placeholder(self, key: ViewKey) -> None:
+        viewport = key.viewport
+        view = QRectF(0, 0, viewport.width, viewport.height)
+        best_source, best_target, best_coverage = None, None, 0
+        for cached_key, cached_image in self.map_cache.around(key.zoom, key.theme):
+            factor = 2 ** (cached_key.zoom - key.zoom)
+            x, y = to_pixels(key.longitude, key.latitude, cached_key.zoom)
+            cached_x, cached_y = to_pixels(cached_key.longitude, cached_key.latitude, cached_key.zoom)
+            cached_viewport = cached_key.viewport
+            target = QRectF((cached_x - cached_viewport.width / 2 - x) / factor + viewport.width / 2,
+                            (cached_y - cached_viewport.height / 2 - y) / factor + viewport.height / 2,
+                            cached_viewport.width / factor, cached_viewport.height / factor)
+            covered = target.intersected(view)
+            coverage = covered.width() * covered.height()
+            if coverage > best_coverage:
+                best_source, best_target, best_coverage = cached_image, target, coverage
+
+        if best_source is None:
+            return
+        placeholder = QImage(viewport.pixel_width, viewport.pixel_height, QImage.Format.Format_RGB32)
+        placeholder.setDevicePixelRatio(viewport.scale)
+        placeholder.fill(QColor('#574e80' if key.theme else '#ededed'))
+        painter = QPainter(placeholder)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        painter.drawImage(best_target, best_source)
+        painter.end()
+        self.image.setPixmap(QPixmap.fromImage(placeholder))
+        self.image.repaint()
     
     def get_map_by_name(self, object_name: str) -> None:
-        search_params = {
-            "apikey": self.search_apikey,
-            "text": object_name,
-            "lang": "ru_RU",
-            "type": 'biz'
-        }
-
-        search_api_server = 'https://search-maps.yandex.ru/v1/'
-        response = requests.get(search_api_server, params=search_params)
-        if not response.ok:
-            self.error_message(message='Ошибка при выполнении запроса к api яндекс карт.')
-        else:
-            json_response = response.json()
+        self.clear_results()
+        self.search_text = object_name
+        self.request_page()
 
-            try:
-                longitude, latitude = json_response['features'][0]['geometry']['coordinates']
-                address_line = json_response['features'][0]['properties']['description']
-                postal_code = self.get_postal_code(address_line) if self.index.isChecked() else None
-                self.address_info = AddressDetails(address_line=address_line, postal_code=postal_code)
-                self.info.setText(f'{address_line}, почтовый индекс: {postal_code}' if postal_code else address_line)
-                self.info.setVisible(True)
-            except IndexError:
-                self.error_message(message='Ошибка при обработке ответа от api яндекс карт.\nВероятная причина - неверный адрес.')
+    def clear_results(self) -> None:
+        # Callbacks are matched by generation, since the same text may be searched again while old jobs run.
+        self.search_generation += 1
+        self.search_text = None
+        self.search_results = []
+        self.search_exhausted = True
+        self.page_future = None
+        self.previews_requested.clear()
+        for future in self.preview_futures:
+            future.cancel()
+        self.preview_futures = []
+        self.results.clear()
+        self.results.setVisible(False)
+
+    def request_page(self) -> None:
+        skip = len(self.search_results)
+        self.page_future = self.run_request(Priority.USER, SEARCH_API_SERVER,
+                                            partial(self.page_loaded, self.search_generation, skip),
+                                            self.search_page, self.search_text, skip)
+
+    def search_page(self, text: str, skip: int) -> list[Place]:
+        places = self.client.search_places(text, SEARCH_PAGE_SIZE, skip)
+        if not places and not skip:
+            raise NothingFound('nothing found')
+        return places
+
+    def page_loaded(self, generation: int, skip: int, future: Future) -> None:
+        if generation != self.search_generation or skip != len(self.search_results):
+            return
+        self.page_future = None
+        places = self.result_of(future, quiet=bool(skip))
+        if places is None:
+            return
+        if not skip:
+            self.show_place(places[0])
+        self.search_results += places
+        self.search_exhausted = len(places) < SEARCH_PAGE_SIZE
+        for place in places:
+            item = QListWidgetItem(place.get_title())
+            item.setSizeHint(QSize(0, PREVIEW_SIZE.height() + 6))
+            self.results.addItem(item)
+        self.results.setVisible(len(self.search_results) > 1)
+        QTimer.singleShot(0, self.request_previews)
+
+    def results_scrolled(self, value: int) -> None:
+        self.request_previews()
+        scroll_bar = self.results.verticalScrollBar()
+        near_end = value >= scroll_bar.maximum() - scroll_bar.pageStep() // 2
+        if near_end and not self.search_exhausted and self.page_future is None:
+            self.request_page()
+
+    def request_previews(self) -> None:
+        visible = self.results.viewport().rect()
+        for row in range(self.results.count()):
+            rect = self.results.visualItemRect(self.results.item(row))
+            if row in self.previews_requested or not rect.intersects(visible):
+                continue
+            self.previews_requested.add(row)
+            place = self.search_results[row]
+            key = ViewKey(latitude=place.latitude, longitude=place.longitude, zoom=PREVIEW_ZOOM, theme=self.nightMode,
+                          viewport=Viewport(PREVIEW_SIZE.width(), PREVIEW_SIZE.height(),
+                                            round(self.devicePixelRatioF(), 1)))
+            # Previews are speculative, so a new view drops the queued ones; they are requested again afterwards.
+            self.preview_futures.append(self.run_request(Priority.PREFETCH, self.map_source.url,
+                                                         partial(self.preview_loaded, self.search_generation, row),
+                                                         self.load_map_image, key))
+
+    def preview_loaded(self, generation: int, row: int, future: Future) -> None:
+        item = self.results.item(row)
+        if generation != self.search_generation or item is None:
+            return
+        if future.cancelled():
+            self.previews_requested.discard(row)
+            return
+        frame = self.result_of(future, quiet=True)
+        if frame is None:
+            return
+        image = frame[0]
+        painter = QPainter(image)
+        draw_marker(painter, PREVIEW_SIZE.width() / 2, PREVIEW_SIZE.height() / 2, size=0.5)
+        painter.end()
+        item.setIcon(QIcon(QPixmap.fromImage(image)))
+
+    def pick_result(self, item: QListWidgetItem) -> None:
+        self.show_place(self.search_results[self.results.row(item)])
+
+    def show_place(self, place: Place) -> None:
+        self.address_info = place.address
+        self.info.setText(place.address.address_line)
+        self.info.setVisible(True)
+        if self.index.isChecked():
+            self.change_postal_code_visibility()
+        self.get_map_by_cords(latitude=place.latitude, longitude=place.longitude, new_point=True)
+        self.latitude.setText(str(place.latitude))
+        self.longitude.setText(str(place.longitude))
+
+    def request_suggestions(self) -> None:
+        text = self.address.text().strip()
+        if len(text) < 3 or text in 'Введите адрес или координаты объекта':
+            return
+        if self.suggest_future:
+            self.suggest_future.cancel()
+            self.suggest_future = None
+
+        cached = self.suggest_cache.get(text)
+        if cached:
+            places, exact = cached
+            self.show_suggestions(places)
+            if exact:
                 return
-            self.get_map_by_cords(latitude=latitude, longitude=longitude, new_point=True)
-            self.latitude.setText(str(latitude))
-            self.longitude.setText(str(longitude))
-            
+        self.suggest_future = self.run_request(Priority.USER, SEARCH_API_SERVER, partial(self.suggestions_loaded, text),
+                                               self.client.suggest, text)
+
+    def suggestions_loaded(self, text: str, future: Future) -> None:
+        if future.cancelled() or future.exception():
+            return
+        places = future.result()
+        self.suggest_cache.put(text, places)
+        if text == self.address.text().strip():
+            self.show_suggestions(places)
+
+    def show_suggestions(self, places: list[Place]) -> None:
+        self.suggestions = {place.get_title(): place for place in places}
+        self.suggest_model.setStringList(list(self.suggestions))
+        if self.suggestions and self.address.hasFocus():
+            self.completer.complete()
+
+    def pick_suggestion(self, title: str) -> None:
+        place = self.suggestions.get(title)
+        if place is not None:
+            self.show_place(place)
+
     def get_map(self) -> None:
         if self.address.text().strip() not in 'Введите адрес или координаты объекта':
             self.get_map_by_name(self.address.text().strip())
         else:
             self.get_map_by_cords(new_point=True)
 
-    def get_postal_code(self, adress_line: str) -> str:
-        search_params = {
-            "apikey": self.geocode_apikey,
-            "geocode": adress_line,
-            "lang": "ru_RU",
-            "format": 'json'
-        }
-
-        geocoder_api_server = 'https://geocode-maps.yandex.ru/v1'
-        response = requests.get(geocoder_api_server, params=search_params)
-        if not response.ok:
-            self.error_message(message='Ошибка при выполнении запроса к api яндекс карт.')
-        else:
-            try:
-                json_response = response.json()
-                object_info = json_response['response']['GeoObjectCollection']['featureMember'][0]['GeoObject']
-                postal_code = object_info['metaDataProperty']['GeocoderMetaData']['Address']['postal_code']
-                return postal_code
-            except KeyError:
-                return ''
-
-    def get_nearest_organisation(self):
-
-        text = self.address_info.address_line if self.address_info else f'{self.current_map.longitude},{self.current_map.latitude}'
-        search_params = {
-            "apikey": self.search_apikey,
-            "text": text,
-            "lang": "ru_RU",
-            "type": 'biz',
-            "ll": f'{self.current_map.longitude},{self.current_map.latitude}',
-            "spn": '0.0015,0.0015',
-            "results": '1',
-            "format": 'json'
-        }
-        geocoder_api_server = 'https://search-maps.yandex.ru/v1/?'
-        response = requests.get(geocoder_api_server, params=search_params)
-        if not response.ok:
-            self.error_message(message='Ошибка при выполнении запроса к api яндекс карт.')
-        else:
-            try:
-                object_data = json_response["features"][0]
-                object_cords = object_data["geometry"]["coordinates"]
-                org_data = object_data["properties"]["CompanyMetaData"]
-                org_name = org_data["name"]
-                org_address = org_data["address"]
-                info = f'{org_name}\n{org_address}\n'
-                if org_data.get("url"):
-                    info += org_data.get("url")
-                if org_data.get("Phones"):
-                    info += f'\n{','.join([ph["formatted"] for ph in org_data.get("Phones")])}'
-                self.address_info = AddressDetails(address_line=info, postal_code='')
-                self.info.setText(f'{info}')
-                self.get_map_by_cords(*object_cords[::-1], True)
-                
-
-            except KeyError:
-                return ''
-    
+    def request_postal_code(self, address_info: AddressDetails) -> None:
+        self.run_request(Priority.BACKGROUND, GEOCODER_API_SERVER, partial(self.postal_code_loaded, address_info),
+                         self.client.postal_code, address_info.address_line)
+
+    def postal_code_loaded(self, address_info: AddressDetails, future: Future) -> None:
+        postal_code = self.result_of(future)
+        if postal_code is None:
+            return
+        address_info.postal_code = postal_code
+        if address_info is self.address_info and self.index.isChecked():
+            self.info.setText(address_info.get_full() if postal_code else address_info.address_line)
+
+    def get_nearest_organisation(self, latitude: float = None, longitude: float = None):
+        if latitude is None or longitude is None:
+            latitude, longitude = self.current_map.latitude, self.current_map.longitude
+        zoom = self.current_map.zoom
+        organisation = self.organisation_cache.get(latitude, longitude, zoom)
+        if organisation is not None:
+            self.report_cache(self.organisation_cache, 'организаций')
+            self.show_organisation(organisation)
+            return
+        text = self.address_info.address_line if self.address_info else None
+        self.run_request(Priority.USER, SEARCH_API_SERVER, partial(self.organisation_loaded, latitude, longitude, zoom),
+                         self.client.nearest_organisation, latitude, longitude, text)
+
+    def organisation_loaded(self, latitude: float, longitude: float, zoom: int, future: Future) -> None:
+        organisation = self.result_of(future)
+        if organisation is None:
+            return
+        self.organisation_cache.put(latitude, longitude, zoom, organisation)
+        self.show_organisation(organisation)
+
+    def show_organisation(self, organisation: Organisation) -> None:
+        info = organisation.get_info()
+        self.address_info = AddressDetails(address_line=info, postal_code='')
+        self.info.setText(f'{info}')
+        self.get_map_by_cords(organisation.latitude, organisation.longitude, True)
+
     def mousePressEvent(self, event):
-        if event.button() == Qt.MouseButton.RightButton:
+        if event.button() == Qt.MouseButton.BackButton:
+            self.go_back()
+        elif event.button() == Qt.MouseButton.ForwardButton:
+            self.go_forward()
+        elif event.button() == Qt.MouseButton.RightButton:
             if self.current_map:
-                self.get_nearest_organisation()
+                position = self.image.mapFrom(self, event.position().toPoint())
+                if self.image.rect().contains(position):
+                    self.get_nearest_organisation(*self.position_to_coordinates(position.x(), position.y()))
+                else:
+                    self.get_nearest_organisation()
+        elif event.button() == Qt.MouseButton.LeftButton and self.current_map:
+            position = self.image.mapFrom(self, event.position().toPoint())
+            if self.image.rect().contains(position) and self.measure.isChecked():
+                self.measure_points.append(self.position_to_coordinates(position.x(), position.y()))
+                self.render_map()
+                self.report_measure()
+            elif self.image.rect().contains(position):
+                self.marker = self.position_to_coordinates(position.x(), position.y())
+                self.render_map()
+                self.get_address_by_cords(*self.marker)
         super().mousePressEvent(event)
 
+    def position_to_coordinates(self, x: float, y: float) -> tuple[float, float]:
+        latitude, longitude = self.current_map.center
+        longitude, latitude = offset(longitude, latitude, self.current_map.zoom,
+                                     x - self.image.width() / 2, y - self.image.height() / 2)
+        return latitude, longitude
+
+    def get_address_by_cords(self, latitude: float, longitude: float) -> None:
+        zoom = self.current_map.zoom
+        address_info = self.address_cache.get(latitude, longitude, zoom)
+        if address_info is not None:
+            self.report_cache(self.address_cache, 'адресов')
+            self.show_address(address_info)
+            return
+        self.run_request(Priority.USER, GEOCODER_API_SERVER, partial(self.address_loaded, latitude, longitude, zoom),
+                         self.client.reverse_geocode, latitude, longitude)
+
+    def address_loaded(self, latitude: float, longitude: float, zoom: int, future: Future) -> None:
+        address_info = self.result_of(future)
+        if address_info is None:
+            return
+        self.address_cache.put(latitude, longitude, zoom, address_info)
+        self.show_address(address_info)
+
+    def report_decode_time(self) -> None:
+        mean = sum(self.decode_times) / len(self.decode_times)
+        stats = self.scheduler.stats()
+        view, prefetch = stats[Priority.VIEW], stats[Priority.PREFETCH]
+        self.statusbar.showMessage(f'декодирование кадра: {self.decode_times[-1] * 1000:.1f} мс '
+                                   f'(среднее {mean * 1000:.1f} мс, макс. {max(self.decode_times) * 1000:.1f} мс), '
+                                   f'ожидание в очереди: {view.mean_wait * 1000:.1f} мс, '
+                                   f'отменено кадров {view.cancelled}, превью {prefetch.cancelled}', 5000)
+
+    def report_cache(self, cache: QuantizedCache, name: str) -> None:
+        self.statusbar.showMessage(f'кэш {name}: попаданий {cache.hit_rate:.0%}, '
+                                   f'погрешность {cache.mean_error:.1f} м (макс. {cache.max_error:.1f} м)', 5000)
+
+    def show_address(self, address_info: AddressDetails) -> None:
+        self.address_info = address_info
+        self.info.setText(address_info.get_full() if self.index.isChecked() and address_info.postal_code
+                          else address_info.address_line)
+        self.info.setVisible(True)
+
     def keyPressEvent(self, event: QKeyEvent) -> None:
         if event.key() == 16777220:
             self.get_map()
 
+        elif event.key() in (Qt.Key.Key_Left, Qt.Key.Key_Right) and event.modifiers() & Qt.KeyboardModifier.AltModifier:
+            self.go_back() if event.key() == Qt.Key.Key_Left else self.go_forward()
+
+        elif event.key() in (Qt.Key.Key_Back, Qt.Key.Key_Forward):
+            self.go_back() if event.key() == Qt.Key.Key_Back else self.go_forward()
+
         elif event.key() in (16777238, 16777239):
             dt = 1 if event.key() == 16777238 else -1
             if 1 <= self.zoom.value() + dt <= 20:
@@ -242,33 +903,28 @@ class Application(QMainWindow):
                 if self.current_map:
                     self.get_map_by_cords(latitude=self.current_map.latitude, longitude=self.current_map.longitude)
 
-        elif self.image.hasFocus() and self.current_map:
-            if event.key() == Qt.Key.Key_Left:
-                lng = self.current_map.longitude
-                new_lng = lng - 180 / 2 ** self.zoom.value()
-                new_lng = new_lng if new_lng > -180 else 180 - abs(new_lng) % 180
-                self.longitude.setText(str(new_lng))
-                self.current_map.longitude = 0
-            if event.key() == Qt.Key.Key_Right:
-                lng = self.current_map.longitude
-                new_lng = lng + 180 / 2 ** self.zoom.value()
-                new_lng = new_lng if new_lng < 180 else -180 + new_lng % 180
-                self.longitude.setText(str(new_lng))
-                self.current_map.longitude = 0
-            if event.key() == Qt.Key.Key_Up:
-                ltd = self.current_map.latitude
-                new_ltd = ltd + 90 / 2 ** self.zoom.value()
-                new_ltd = new_ltd if new_ltd < 90 else -90 + new_ltd % 90
-                self.latitude.setText(str(new_ltd))
-                self.current_map.latitude = 0
-            if event.key() == Qt.Key.Key_Down:
-                ltd = self.current_map.latitude
-                new_ltd = ltd - 90 / 2 ** self.zoom.value()
-                new_ltd = new_ltd if new_ltd < 90 else -90 + new_ltd % 90
-                self.latitude.setText(str(new_ltd))
-                self.current_map.latitude = 0
-            self.get_map_by_cords()
-        
+        elif event.key() == Qt.Key.Key_Backspace and self.image.hasFocus() and self.measure_points:
+            self.measure_points.pop()
+            self.render_map()
+            self.report_measure()
+
+        elif event.key() in (Qt.Key.Key_Escape, Qt.Key.Key_Delete) and self.image.hasFocus() and self.current_map:
+            if self.measure_points:
+                self.measure_points = []
+                self.report_measure()
+            else:
+                self.marker = None
+            self.render_map()
+
+        elif self.image.hasFocus() and self.current_map and event.key() in PAN_STEPS:
+            d_latitude, d_longitude = PAN_STEPS[event.key()]
+            step = 2 ** self.zoom.value()
+            key = self.current_map.replace(latitude=self.current_map.latitude + d_latitude / step,
+                                           longitude=self.current_map.longitude + d_longitude / step)
+            self.latitude.setText(str(key.latitude))
+            self.longitude.setText(str(key.longitude))
+            self.get_map_by_cords(key.latitude, key.longitude)
+
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
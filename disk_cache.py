@@ -0,0 +1,93 @@
+from dataclasses import dataclass, field
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    content_type: str
+    stored: float
+    headers: dict = field(default_factory=dict)
+
+
+class DiskCache:
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                                '(key TEXT PRIMARY KEY, body BLOB, content_type TEXT, stored REAL, headers TEXT)')
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(entries)')]
+        if 'headers' not in columns:
+            self.connection.execute('ALTER TABLE entries ADD COLUMN headers TEXT')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS entries_stored ON entries (stored)')
+        self.connection.commit()
+        self.max_bytes = max_bytes
+        self.size = self.connection.execute('SELECT COALESCE(SUM(LENGTH(body)), 0) FROM entries').fetchone()[0]
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self.lock:
+            row = self.connection.execute('SELECT body, content_type, stored, headers FROM entries WHERE key = ?',
+                                          (key,)).fetchone()
+        if row is None:
+            return None
+        body, content_type, stored, headers = row
+        return CacheEntry(body=body, content_type=content_type, stored=stored, headers=json.loads(headers or '{}'))
+
+    def put(self, key: str, body: bytes, content_type: str, headers: dict = None) -> None:
+        with self.lock:
+            self.size -= self._body_size(key)
+            self.connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                                    (key, body, content_type, time.time(), json.dumps(headers or {})))
+            self.size += len(body)
+            if self.size > self.max_bytes:
+                self._evict(self.size - self.max_bytes)
+            self.connection.commit()
+
+    def touch(self, key: str, headers: dict) -> None:
+        with self.lock:
+            self.connection.execute('UPDATE entries SET stored = ?, headers = ? WHERE key = ?',
+                                    (time.time(), json.dumps(headers), key))
+            self.connection.commit()
+
+    def entries(self) -> list[tuple[str, float, dict]]:
+        with self.lock:
+            rows = self.connection.execute('SELECT key, stored, headers FROM entries').fetchall()
+        return [(key, stored, json.loads(headers or '{}')) for key, stored, headers in rows]
+
+    def delete(self, keys: list[str]) -> None:
+        with self.lock:
+            for key in keys:
+                self.size -= self._body_size(key)
+                self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self.connection.commit()
+
+    def _body_size(self, key: str) -> int:
+        row = self.connection.execute('SELECT LENGTH(body) FROM entries WHERE key = ?', (key,)).fetchone()
+        return (row[0] or 0) if row else 0
+
+    def _evict(self, excess: int) -> None:
+        # Entries that were stored or revalidated longest ago go first.
+        evicted = []
+        for key, size in self.connection.execute('SELECT key, LENGTH(body) FROM entries ORDER BY stored'):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size or 0
+            self.size -= size or 0
+        self.connection.executemany('DELETE FROM entries WHERE key = ?', evicted)
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM entries WHERE key = ?', (key,)).fetchone() is not None
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,197 @@
+from dotenv import load_dotenv
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from map_client import AddressDetails, Place
+
+
+GAZETTEER_PATH = 'cache/gazetteer.sqlite3'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS places (
+    id INTEGER PRIMARY KEY,
+    source_id TEXT UNIQUE,
+    name TEXT,
+    address TEXT,
+    postal_code TEXT,
+    latitude REAL,
+    longitude REAL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS places_fts USING fts5(
+    name, address, content='places', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS places_insert AFTER INSERT ON places BEGIN
+    INSERT INTO places_fts(rowid, name, address) VALUES (new.id, new.name, new.address);
+END;
+CREATE TRIGGER IF NOT EXISTS places_delete AFTER DELETE ON places BEGIN
+    INSERT INTO places_fts(places_fts, rowid, name, address) VALUES ('delete', old.id, old.name, old.address);
+END;
+CREATE TRIGGER IF NOT EXISTS places_update AFTER UPDATE ON places BEGIN
+    INSERT INTO places_fts(places_fts, rowid, name, address) VALUES ('delete', old.id, old.name, old.address);
+    INSERT INTO places_fts(rowid, name, address) VALUES (new.id, new.name, new.address);
+END;
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    rows INTEGER
+);
+'''
+
+
+def match_query(text: str, prefix: bool = False) -> str:
+    tokens = re.findall(r'\w+', text.lower())
+    # A search matches whole tokens so that house 1 does not resolve to house 12; only the last word
+    # may be cut short. Suggestions complete every token.
+    last_word = max((index for index, token in enumerate(tokens) if not token[0].isdigit()), default=None)
+    return ' '.join(f'"{token}"*' if prefix or index == last_word else f'"{token}"'
+                    for index, token in enumerate(tokens))
+
+
+class Gazetteer:
+    def __init__(self, path: str = GAZETTEER_PATH) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute('SELECT count(*) FROM places').fetchone()[0]
+
+    def search(self, text: str, limit: int = 5, offset: int = 0, prefix: bool = False) -> list[Place]:
+        query = match_query(text, prefix)
+        if not query:
+            return []
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT places.name, places.address, places.postal_code, places.latitude, places.longitude '
+                'FROM places_fts JOIN places ON places.id = places_fts.rowid '
+                'WHERE places_fts MATCH ? ORDER BY bm25(places_fts) LIMIT ? OFFSET ?',
+                (query, limit, offset)).fetchall()
+        return [Place(latitude=latitude, longitude=longitude, name=name or '',
+                      address=AddressDetails(address_line=address, postal_code=postal_code or None))
+                for name, address, postal_code, latitude, longitude in rows]
+
+    def lookup(self, text: str) -> Place | None:
+        places = self.search(text, limit=1)
+        if places:
+            self.hits += 1
+            return places[0]
+        self.misses += 1
+        return None
+
+    def import_file(self, path: str, force: bool = False) -> int:
+        stat = os.stat(path)
+        with self.lock:
+            known = self.connection.execute('SELECT size, mtime FROM imports WHERE path = ?',
+                                            (os.path.abspath(path),)).fetchone()
+        if known == (stat.st_size, stat.st_mtime) and not force:
+            return 0
+
+        rows = read_geojson(path) if path.endswith(('.geojson', '.json')) else read_csv(path)
+        count = 0
+        with self.lock, self.connection:
+            for row in rows:
+                cursor = self.connection.execute(
+                    'INSERT INTO places (source_id, name, address, postal_code, latitude, longitude) '
+                    'VALUES (:source_id, :name, :address, :postal_code, :latitude, :longitude) '
+                    'ON CONFLICT(source_id) DO UPDATE SET name = excluded.name, address = excluded.address, '
+                    'postal_code = excluded.postal_code, latitude = excluded.latitude, '
+                    'longitude = excluded.longitude '
+                    'WHERE (name, address, postal_code, latitude, longitude) IS NOT '
+                    '(excluded.name, excluded.address, excluded.postal_code, excluded.latitude, excluded.longitude)',
+                    row)
+                count += cursor.rowcount
+            self.connection.execute('INSERT OR REPLACE INTO imports VALUES (?, ?, ?, ?)',
+                                    (os.path.abspath(path), stat.st_size, stat.st_mtime, count))
+        return count
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+def open_gazetteer() -> Gazetteer | None:
+    path = os.getenv('GAZETTEER_PATH', GAZETTEER_PATH)
+    return Gazetteer(path) if os.path.exists(path) else None
+
+
+def source_id(name: str, address: str, latitude: float, longitude: float) -> str:
+    return hashlib.sha1(f'{name}|{address}|{latitude:.6f}|{longitude:.6f}'.encode()).hexdigest()
+
+
+def read_csv(path: str):
+    with open(path, encoding='utf-8', newline='') as file:
+        for record in csv.DictReader(file):
+            try:
+                latitude, longitude = float(record['latitude']), float(record['longitude'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            name, address = record.get('name') or '', record.get('address') or ''
+            yield {'source_id': record.get('id') or source_id(name, address, latitude, longitude),
+                   'name': name, 'address': address or name, 'postal_code': record.get('postal_code') or None,
+                   'latitude': latitude, 'longitude': longitude}
+
+
+def read_geojson(path: str):
+    with open(path, encoding='utf-8') as file:
+        collection = json.load(file)
+    for feature in collection.get('features', []):
+        geometry, tags = feature.get('geometry') or {}, feature.get('properties') or {}
+        if geometry.get('type') != 'Point':
+            continue
+        longitude, latitude = geometry['coordinates'][:2]
+        street = ', '.join(part for part in (tags.get('addr:street'), tags.get('addr:housenumber')) if part)
+        address = ', '.join(part for part in (tags.get('addr:city'), street) if part) or tags.get('address', '')
+        name = tags.get('name', '')
+        if not (name or address):
+            continue
+        osm_id = feature.get('id') or tags.get('@id')
+        yield {'source_id': str(osm_id) if osm_id else source_id(name, address, latitude, longitude),
+               'name': name, 'address': address or name, 'postal_code': tags.get('addr:postcode'),
+               'latitude': latitude, 'longitude': longitude}
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Offline gazetteer for address lookups')
+    parser.add_argument('--db', default=os.getenv('GAZETTEER_PATH', GAZETTEER_PATH))
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_command = commands.add_parser('import', help='import CSV or GeoJSON files incrementally')
+    import_command.add_argument('files', nargs='+')
+    import_command.add_argument('--force', action='store_true')
+    lookup_command = commands.add_parser('lookup', help='resolve a query against the index')
+    lookup_command.add_argument('text')
+    args = parser.parse_args()
+
+    gazetteer = Gazetteer(args.db)
+    if args.command == 'import':
+        for path in args.files:
+            start = time.perf_counter()
+            count = gazetteer.import_file(path, force=args.force)
+            print(f'{path}: {count} rows changed in {time.perf_counter() - start:.2f} s')
+        print(f'{len(gazetteer)} places in {args.db}')
+    else:
+        start = time.perf_counter()
+        places = gazetteer.search(args.text)
+        elapsed = (time.perf_counter() - start) * 1000
+        for place in places:
+            print(f'{place.latitude}, {place.longitude}  {place.get_title()}')
+        print(f'{len(places)} results in {elapsed:.3f} ms', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
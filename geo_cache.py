@@ -0,0 +1,52 @@
+from collections import OrderedDict
+from typing import Any
+
+from projection import haversine, to_pixels
+
+
+class QuantizedCache:
+    def __init__(self, cell_pixels: int = 8, max_entries: int = 4096) -> None:
+        self.cell_pixels = cell_pixels
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.total_error = 0.0
+        self.max_error = 0.0
+
+    def cell(self, latitude: float, longitude: float, zoom: int) -> tuple[int, int, int]:
+        x, y = to_pixels(longitude, latitude, zoom)
+        return zoom, int(x // self.cell_pixels), int(y // self.cell_pixels)
+
+    def get(self, latitude: float, longitude: float, zoom: int) -> Any:
+        cell = self.cell(latitude, longitude, zoom)
+        entry = self.entries.get(cell)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(cell)
+        self.hits += 1
+        error = haversine(latitude, longitude, entry[0], entry[1])
+        self.total_error += error
+        self.max_error = max(self.max_error, error)
+        return entry[2]
+
+    def put(self, latitude: float, longitude: float, zoom: int, value: Any) -> None:
+        cell = self.cell(latitude, longitude, zoom)
+        self.entries[cell] = (latitude, longitude, value)
+        self.entries.move_to_end(cell)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def mean_error(self) -> float:
+        return self.total_error / self.hits if self.hits else 0.0
+
+    def stats(self) -> dict:
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate, 'mean_error': self.mean_error, 'max_error': self.max_error}
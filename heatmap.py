@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from point_layer import (CLUSTER_RATIO, INDEX_BITS, MAX_ZOOM, Level, cluster, morton, project, random_points,
+                         read_csv, read_geojson)
+from projection import TILE_SIZE, world_size
+
+
+HEATMAP_PATH = 'cache/heatmap.csv'
+BIN_BITS = 2
+TILE_BINS = TILE_SIZE >> BIN_BITS
+SIGMA = 2.0
+MAX_TILES = 1024
+COLOR_STOPS = ((0.0, (0, 0, 255, 0)), (0.15, (0, 90, 255, 90)), (0.4, (0, 220, 120, 150)),
+               (0.65, (255, 230, 0, 180)), (1.0, (230, 20, 0, 210)))
+
+
+def gaussian_kernel(sigma: float) -> np.ndarray:
+    radius = math.ceil(3 * sigma)
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def blur(values: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    # Separable blur over a halo of len(kernel) // 2 bins; the result is smaller by the halo on every side.
+    halo = len(kernel) // 2
+    height, width = values.shape[0] - 2 * halo, values.shape[1] - 2 * halo
+    rows = sum(weight * values[:, index:index + width] for index, weight in enumerate(kernel))
+    return sum(weight * rows[index:index + height] for index, weight in enumerate(kernel))
+
+
+def color_table(stops=COLOR_STOPS, size: int = 256) -> np.ndarray:
+    positions = np.linspace(0, 1, size)
+    offsets = [offset for offset, _ in stops]
+    channels = [np.interp(positions, offsets, [color[channel] for _, color in stops]) for channel in range(4)]
+    return np.column_stack(channels).round().astype(np.uint8)
+
+
+class HeatmapLayer:
+    def __init__(self, x: np.ndarray, y: np.ndarray, weights: np.ndarray, max_tiles: int = MAX_TILES) -> None:
+        x, y = np.asarray(x, dtype=np.uint32), np.asarray(y, dtype=np.uint32)
+        keys = morton(x, y)
+        order = np.argsort(keys, kind='stable')
+        self.points = Level(keys[order], x[order], y[order], np.asarray(weights, dtype=np.float64)[order])
+        # Every level holds the weighted bins of one zoom, so a tile sums a few thousand bins, not every point.
+        self.levels = {}
+        for zoom in range(MAX_ZOOM + 1):
+            level = cluster(self.points, zoom, BIN_BITS)
+            if len(level) > CLUSTER_RATIO * len(self.points):
+                break
+            self.levels[zoom] = level
+        self.kernel = gaussian_kernel(SIGMA)
+        self.colors = color_table()
+        self.tiles = OrderedDict()
+        self.max_tiles = max_tiles
+        self.peaks = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_coordinates(cls, latitudes: np.ndarray, longitudes: np.ndarray,
+                         weights: np.ndarray = None) -> 'HeatmapLayer':
+        x, y = project(latitudes, longitudes)
+        return cls(x, y, np.ones(len(x)) if weights is None else weights)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'HeatmapLayer':
+        read = read_geojson if path.endswith(('.geojson', '.json')) else read_csv
+        return cls.from_coordinates(*read(path))
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def tile(self, zoom: int, column: int, row: int) -> np.ndarray:
+        key = zoom, column, row
+        density = self.tiles.get(key)
+        if density is not None:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return density
+        self.misses += 1
+        level = self.levels.get(zoom, self.points)
+        halo = len(self.kernel) // 2
+        size = TILE_BINS + 2 * halo
+        unit = 2 ** (INDEX_BITS - 8 - zoom + BIN_BITS)
+        left, top = column * TILE_BINS - halo, row * TILE_BINS - halo
+        found, x = level.find(left * unit, top * unit, (left + size) * unit, (top + size) * unit)
+        bins = (level.y[found].astype(np.int64) // unit - top) * size + (x // unit - left)
+        counts = np.bincount(bins, weights=level.counts[found], minlength=size * size).reshape(size, size)
+        density = blur(counts.astype(np.float32), self.kernel)
+        self.tiles[key] = density
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        self.peaks[zoom] = max(self.peaks.get(zoom, 0.0), float(density.max()))
+        return density
+
+    def render(self, zoom: int, left: float, top: float, width: float,
+               height: float) -> tuple[np.ndarray, float, float] | None:
+        columns = range(math.floor(left / TILE_SIZE), math.ceil((left + width) / TILE_SIZE))
+        rows = range(max(math.floor(top / TILE_SIZE), 0), min(math.ceil((top + height) / TILE_SIZE), 2 ** zoom))
+        if not rows:
+            return None
+        density = np.empty((len(rows) * TILE_BINS, len(columns) * TILE_BINS), dtype=np.float32)
+        for y, row in enumerate(rows):
+            for x, column in enumerate(columns):
+                density[y * TILE_BINS:(y + 1) * TILE_BINS, x * TILE_BINS:(x + 1) * TILE_BINS] = \
+                    self.tile(zoom, column % 2 ** zoom, row)
+        peak = self.peaks.get(zoom, 0.0)
+        if peak <= 0:
+            return None
+        # Logarithmic scale against the densest tile seen at this zoom, so panning keeps the colours stable.
+        levels = np.log1p(density) * ((len(self.colors) - 1) / math.log1p(peak))
+        rgba = self.colors[np.minimum(levels, len(self.colors) - 1).astype(np.uint8)]
+        return rgba, columns.start * TILE_SIZE - left, rows.start * TILE_SIZE - top
+
+
+def open_heatmap() -> HeatmapLayer | None:
+    path = os.getenv('HEATMAP_PATH', HEATMAP_PATH)
+    return HeatmapLayer.from_file(path) if os.path.exists(path) else None
+
+
+def benchmark(layer: HeatmapLayer, frames: int, width: int, height: int) -> None:
+    random.seed(0)
+    latencies = {'zoom': [], 'pan': []}
+    for _ in range(frames):
+        index = random.randrange(len(layer))
+        zoom = random.randint(1, MAX_ZOOM)
+        units = 2 ** INDEX_BITS / world_size(zoom)
+        x, y = layer.points.x[index] / units - width / 2, layer.points.y[index] / units - height / 2
+        for kind, dx in (('zoom', 0), ('pan', random.uniform(-0.25, 0.25) * width)):
+            start = time.perf_counter()
+            layer.render(zoom, x + dx, y, width, height)
+            latencies[kind].append((time.perf_counter() - start) * 1000)
+    for kind, values in latencies.items():
+        values.sort()
+        print(f'{kind:>4}: median {statistics.median(values):.2f} ms, p99 {values[int(len(values) * 0.99)]:.2f} ms, '
+              f'max {values[-1]:.2f} ms')
+    print(f'tile cache: {layer.hits} hits, {layer.misses} misses')
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Time heatmap rendering at random views')
+    parser.add_argument('input', nargs='?', default=os.getenv('HEATMAP_PATH', HEATMAP_PATH))
+    parser.add_argument('--random', type=int, help='use this many generated points instead of a file')
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--size', default='650,450', help='viewport width,height')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.random:
+        weights = np.random.default_rng(0).exponential(1, args.random)
+        layer = HeatmapLayer.from_coordinates(*random_points(args.random), weights)
+    else:
+        layer = HeatmapLayer.from_file(args.input)
+    print(f'{len(layer)} points, {len(layer.levels)} bin levels in {time.perf_counter() - start:.2f} s',
+          file=sys.stderr)
+    benchmark(layer, args.frames, *map(int, args.size.split(',')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class HistoryEntry:
+    state: Any
+    image: bytes
+
+
+class NavigationHistory:
+    def __init__(self, max_entries: int = 100, max_bytes: int = 32 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = []
+        self.index = -1
+        self.size = 0
+
+    @property
+    def current(self) -> HistoryEntry | None:
+        return self.entries[self.index] if self.entries else None
+
+    def can_go_back(self) -> bool:
+        return self.index > 0
+
+    def can_go_forward(self) -> bool:
+        return self.index < len(self.entries) - 1
+
+    def push(self, state: Any, image: bytes = b'') -> HistoryEntry:
+        for entry in self.entries[self.index + 1:]:
+            self.size -= len(entry.image)
+        del self.entries[self.index + 1:]
+        entry = HistoryEntry(state=state, image=image)
+        self.entries.append(entry)
+        self.size += len(image)
+        self.index = len(self.entries) - 1
+        self.trim()
+        return entry
+
+    def set_image(self, entry: HistoryEntry, image: bytes) -> None:
+        # Entries may be pushed before their image is encoded; one that was dropped meanwhile is ignored.
+        if not any(known is entry for known in self.entries):
+            return
+        self.size += len(image) - len(entry.image)
+        entry.image = image
+        self.trim()
+
+    def trim(self) -> None:
+        while self.index > 0 and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            self.size -= len(self.entries.pop(0).image)
+            self.index -= 1
+
+    def back(self) -> HistoryEntry | None:
+        if not self.can_go_back():
+            return None
+        self.index -= 1
+        return self.entries[self.index]
+
+    def forward(self) -> HistoryEntry | None:
+        if not self.can_go_forward():
+            return None
+        self.index += 1
+        return self.entries[self.index]
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.index = -1
+        self.size = 0
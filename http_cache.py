@@ -0,0 +1,162 @@
+from email.utils import parsedate_to_datetime
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from disk_cache import CacheEntry, DiskCache
+
+
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Expires', 'Date', 'Age')
+
+
+def cache_key(url: str, params: dict = None) -> str:
+    query = '&'.join(f'{name}={value}' for name, value in sorted((params or {}).items())
+                     if name != 'apikey' and value is not None)
+    return f'{url}?{query}'
+
+
+def parse_cache_control(value: str | None) -> dict[str, str | None]:
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def http_date(value: str | None) -> float | None:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(headers: dict, shared: bool = False, default: float = 0) -> float:
+    directives = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-cache' in directives:
+        return 0
+    for name in ('s-maxage', 'max-age') if shared else ('max-age',):
+        if (directives.get(name) or '').isdigit():
+            return int(directives[name])
+    expires, date = http_date(headers.get('Expires')), http_date(headers.get('Date'))
+    if expires is not None:
+        return max(0, expires - (date or time.time()))
+    last_modified = http_date(headers.get('Last-Modified'))
+    if last_modified is not None and date is not None:
+        return max(0, (date - last_modified) / 10)
+    return default
+
+
+def is_storable(status: int, headers, shared: bool = False) -> bool:
+    directives = parse_cache_control(headers.get('Cache-Control'))
+    return status == 200 and 'no-store' not in directives and not (shared and 'private' in directives)
+
+
+def stored_headers(headers) -> dict:
+    return {name: headers[name] for name in STORED_HEADERS if name in headers}
+
+
+def conditional_headers(entry: CacheEntry) -> dict:
+    headers = {}
+    if 'ETag' in entry.headers:
+        headers['If-None-Match'] = entry.headers['ETag']
+    if 'Last-Modified' in entry.headers:
+        headers['If-Modified-Since'] = entry.headers['Last-Modified']
+    return headers
+
+
+def cached_response(entry: CacheEntry, url: str, cache_status: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = entry.body
+    response.headers = CaseInsensitiveDict(entry.headers)
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+class HttpCache:
+    def __init__(self, cache: DiskCache, shared: bool = False, default_lifetime: float = 0) -> None:
+        self.cache = cache
+        self.shared = shared
+        self.default_lifetime = default_lifetime
+        self.lock = threading.Lock()
+        self.fresh = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.saved_bytes = 0
+
+    def is_fresh(self, entry: CacheEntry, now: float = None) -> bool:
+        age = (now or time.time()) - entry.stored + int(entry.headers.get('Age', '0') or 0)
+        return age < freshness_lifetime(entry.headers, self.shared, self.default_lifetime)
+
+    def fetch(self, session: requests.Session, url: str, params: dict = None, key: str = None) -> requests.Response:
+        key = key or cache_key(url, params)
+        entry = self.cache.get(key)
+        if entry is not None and self.is_fresh(entry):
+            self.hit(entry)
+            return cached_response(entry, url, 'HIT')
+
+        response = session.get(url, params=params, headers=conditional_headers(entry) if entry else None)
+        if response.status_code == 304 and entry is not None:
+            self.refresh(key, entry, response.headers)
+            return cached_response(entry, url, 'REVALIDATED')
+
+        self.store(key, response.status_code, response.headers, response.content)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    async def fetch_async(self, session, url: str, params: dict = None, key: str = None) -> tuple[int, bytes]:
+        # The same protocol for an aiohttp session; the sqlite lookups are short enough to run on the event loop.
+        key = key or cache_key(url, params)
+        entry = self.cache.get(key)
+        if entry is not None and self.is_fresh(entry):
+            self.hit(entry)
+            return 200, entry.body
+
+        async with session.get(url, params=params, headers=conditional_headers(entry) if entry else None) as response:
+            status, headers, body = response.status, response.headers, await response.read()
+        if status == 304 and entry is not None:
+            self.refresh(key, entry, headers)
+            return 200, entry.body
+
+        self.store(key, status, headers, body)
+        return status, body
+
+    def hit(self, entry: CacheEntry) -> None:
+        with self.lock:
+            self.fresh += 1
+            self.saved_bytes += len(entry.body)
+
+    def refresh(self, key: str, entry: CacheEntry, headers) -> None:
+        entry.headers.update(stored_headers(headers))
+        entry.headers.pop('Age', None)
+        self.cache.touch(key, entry.headers)
+        with self.lock:
+            self.revalidated += 1
+            self.saved_bytes += len(entry.body)
+
+    def store(self, key: str, status: int, headers, body: bytes) -> None:
+        with self.lock:
+            self.misses += 1
+        stored = stored_headers(headers)
+        reusable = ('ETag' in stored or 'Last-Modified' in stored
+                    or freshness_lifetime(stored, self.shared, self.default_lifetime) > 0)
+        if reusable and is_storable(status, headers, self.shared):
+            self.cache.put(key, body, headers.get('Content-Type', ''), stored)
+
+    def purge(self, max_idle: float = 30 * 24 * 3600) -> int:
+        # A stale entry without validators can never be reused, and one left alone for a month is unlikely to be.
+        now = time.time()
+        expired = [key for key, stored, headers in self.cache.entries()
+                   if now - stored > max_idle or ('ETag' not in headers and 'Last-Modified' not in headers
+                                                  and not self.is_fresh(CacheEntry(b'', '', stored, headers), now))]
+        self.cache.delete(expired)
+        return len(expired)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'fresh': self.fresh, 'revalidated': self.revalidated, 'misses': self.misses,
+                    'saved_bytes': self.saved_bytes}
@@ -0,0 +1,45 @@
+from collections import OrderedDict
+from typing import Any
+
+from view_key import ViewKey
+
+
+class MapCache:
+    def __init__(self, max_entries: int = 64, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: ViewKey) -> Any:
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key: ViewKey, value: Any, size: int = 0) -> None:
+        self.size += size - self.sizes.get(key, 0)
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.entries.move_to_end(key)
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            evicted, _ = self.entries.popitem(last=False)
+            self.size -= self.sizes.pop(evicted)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def around(self, zoom: int, theme: bool, depth: int = 2) -> list[tuple[ViewKey, Any]]:
+        related = [(key, value) for key, value in self.entries.items()
+                   if key.theme == theme and abs(key.zoom - zoom) <= depth]
+        return sorted(related, key=lambda item: abs(item[0].zoom - zoom))
@@ -0,0 +1,342 @@
+from dataclasses import dataclass, field
+from functools import partial
+import json
+import os
+
+import requests
+
+from singleflight import AsyncSingleFlight, SingleFlight, request_key
+from view_key import ViewKey
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+MAP_API_SERVER = 'https://static-maps.yandex.ru/v1'
+SEARCH_API_SERVER = 'https://search-maps.yandex.ru/v1/'
+GEOCODER_API_SERVER = 'https://geocode-maps.yandex.ru/v1'
+LOCAL_ADDRESS_DISTANCE = 100
+SEARCH_PAGE_SIZE = 10
+
+
+class MapClientError(Exception):
+    pass
+
+
+class NothingFound(MapClientError):
+    pass
+
+
+@dataclass
+class AddressDetails:
+    address_line: str
+    postal_code: str
+
+    def get_full(self):
+        return f'{self.address_line}, почтовый индекс: {self.postal_code}'
+
+
+@dataclass
+class Place:
+    latitude: float
+    longitude: float
+    address: AddressDetails
+    name: str = ''
+
+    def get_title(self) -> str:
+        return f'{self.name}, {self.address.address_line}' if self.name else self.address.address_line
+
+
+@dataclass
+class Organisation:
+    name: str
+    address: str
+    latitude: float
+    longitude: float
+    url: str = ''
+    phones: list[str] = field(default_factory=list)
+
+    def get_info(self) -> str:
+        info = f'{self.name}\n{self.address}\n'
+        if self.url:
+            info += self.url
+        if self.phones:
+            info += f'\n{','.join(self.phones)}'
+        return info
+
+
+def map_params(view: ViewKey, apikey: str, size: str = '450,450', scale: float = 1.0) -> dict:
+    return {
+        "apikey": apikey,
+        "ll": f'{view.center[1]},{view.center[0]}',
+        "z": view.zoom,
+        "size": size,
+        "scale": scale,
+        "pt": view.point,
+        "theme": 'dark' if view.theme else 'light'
+    }
+
+
+def search_params(text: str, apikey: str, results: int = None, skip: int = 0) -> dict:
+    params = {
+        "apikey": apikey,
+        "text": text,
+        "lang": "ru_RU",
+        "type": 'biz'
+    }
+    if results:
+        params["results"] = str(results)
+    if skip:
+        params["skip"] = str(skip)
+    return params
+
+
+def geocode_params(address_line: str, apikey: str) -> dict:
+    return {
+        "apikey": apikey,
+        "geocode": address_line,
+        "lang": "ru_RU",
+        "format": 'json'
+    }
+
+
+def organisation_params(latitude: float, longitude: float, text: str, apikey: str) -> dict:
+    return {
+        "apikey": apikey,
+        "text": text,
+        "lang": "ru_RU",
+        "type": 'biz',
+        "ll": f'{longitude},{latitude}',
+        "spn": '0.0015,0.0015',
+        "results": '1',
+        "format": 'json'
+    }
+
+
+def parse_place(json_response: dict) -> Place:
+    places = parse_places(json_response)
+    if not places:
+        raise NothingFound('nothing found')
+    return places[0]
+
+
+def parse_places(json_response: dict) -> list[Place]:
+    places = []
+    for feature in json_response.get('features', []):
+        try:
+            longitude, latitude = feature['geometry']['coordinates']
+            address_line = feature['properties']['description']
+        except (KeyError, ValueError):
+            continue
+        places.append(Place(latitude=latitude, longitude=longitude, name=feature['properties'].get('name', ''),
+                            address=AddressDetails(address_line=address_line, postal_code=None)))
+    return places
+
+
+def parse_postal_code(json_response: dict) -> str:
+    try:
+        object_info = json_response['response']['GeoObjectCollection']['featureMember'][0]['GeoObject']
+        return object_info['metaDataProperty']['GeocoderMetaData']['Address']['postal_code']
+    except (KeyError, IndexError):
+        return ''
+
+
+def parse_address(json_response: dict) -> AddressDetails:
+    try:
+        object_info = json_response['response']['GeoObjectCollection']['featureMember'][0]['GeoObject']
+        metadata = object_info['metaDataProperty']['GeocoderMetaData']
+    except (KeyError, IndexError):
+        raise NothingFound('nothing found') from None
+    return AddressDetails(address_line=metadata['text'], postal_code=metadata['Address'].get('postal_code', ''))
+
+
+def parse_organisation(json_response: dict) -> Organisation | None:
+    try:
+        object_data = json_response["features"][0]
+        longitude, latitude = object_data["geometry"]["coordinates"]
+        org_data = object_data["properties"]["CompanyMetaData"]
+        return Organisation(name=org_data["name"], address=org_data["address"], latitude=latitude,
+                            longitude=longitude, url=org_data.get("url", ''),
+                            phones=[phone["formatted"] for phone in org_data.get("Phones", [])])
+    except (KeyError, IndexError):
+        return None
+
+
+def local_address(reverse_geocoder, latitude: float, longitude: float) -> Place | None:
+    if reverse_geocoder is None:
+        return None
+    nearest = reverse_geocoder.nearest(latitude, longitude, max_distance=LOCAL_ADDRESS_DISTANCE)
+    return nearest[0] if nearest else None
+
+
+def local_organisation(reverse_geocoder, latitude: float, longitude: float) -> Organisation | None:
+    place = local_address(reverse_geocoder, latitude, longitude)
+    if place is None or not place.name:
+        return None
+    return Organisation(name=place.name, address=place.address.address_line, latitude=place.latitude,
+                        longitude=place.longitude)
+
+
+class MapClient:
+    def __init__(self, static_apikey: str, search_apikey: str, geocode_apikey: str,
+                 map_server: str = MAP_API_SERVER, session: requests.Session = None, gazetteer=None,
+                 reverse_geocoder=None, http_cache=None) -> None:
+        self.static_apikey = static_apikey
+        self.search_apikey = search_apikey
+        self.geocode_apikey = geocode_apikey
+        self.map_server = map_server
+        self.session = session or requests.Session()
+        self.gazetteer = gazetteer
+        self.reverse_geocoder = reverse_geocoder
+        self.http_cache = http_cache
+        self.flights = SingleFlight()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'MapClient':
+        kwargs.setdefault('map_server', os.getenv('MAP_API_SERVER', MAP_API_SERVER))
+        return cls(os.getenv('STATIC_APIKEY'), os.getenv('SEARCH_APIKEY'), os.getenv('GEOCODE_APIKEY'), **kwargs)
+
+    def fetch(self, url: str, params: dict) -> requests.Response:
+        try:
+            get = partial(self.http_cache.fetch, self.session) if self.http_cache else self.session.get
+            response = self.flights.do(request_key(url, params), get, url, params=params)
+        except requests.RequestException as error:
+            raise MapClientError(str(error)) from error
+        if not response.ok:
+            raise MapClientError(f'{url} responded with {response.status_code}')
+        return response
+
+    def map_image(self, view: ViewKey, size: str = '450,450', scale: float = 1.0) -> bytes:
+        return self.fetch(self.map_server, map_params(view, self.static_apikey, size, scale)).content
+
+    def search(self, text: str) -> Place:
+        place = self.gazetteer.lookup(text) if self.gazetteer else None
+        if place is not None:
+            return place
+        return parse_place(self.fetch(SEARCH_API_SERVER, search_params(text, self.search_apikey)).json())
+
+    def search_places(self, text: str, results: int = SEARCH_PAGE_SIZE, skip: int = 0) -> list[Place]:
+        if self.gazetteer and self.gazetteer.search(text, limit=1):
+            return self.gazetteer.search(text, limit=results, offset=skip)
+        params = search_params(text, self.search_apikey, results, skip)
+        return parse_places(self.fetch(SEARCH_API_SERVER, params).json())
+
+    def suggest(self, text: str, results: int = 5) -> list[Place]:
+        places = self.gazetteer.search(text, limit=results, prefix=True) if self.gazetteer else []
+        if places:
+            return places
+        return parse_places(self.fetch(SEARCH_API_SERVER, search_params(text, self.search_apikey, results)).json())
+
+    def postal_code(self, address_line: str) -> str:
+        response = self.fetch(GEOCODER_API_SERVER, geocode_params(address_line, self.geocode_apikey))
+        return parse_postal_code(response.json())
+
+    def reverse_geocode(self, latitude: float, longitude: float) -> AddressDetails:
+        place = local_address(self.reverse_geocoder, latitude, longitude)
+        if place is not None:
+            return place.address
+        response = self.fetch(GEOCODER_API_SERVER, geocode_params(f'{longitude},{latitude}', self.geocode_apikey))
+        return parse_address(response.json())
+
+    def nearest_organisation(self, latitude: float, longitude: float, text: str = None) -> Organisation | None:
+        organisation = local_organisation(self.reverse_geocoder, latitude, longitude)
+        if organisation is not None:
+            return organisation
+        params = organisation_params(latitude, longitude, text or f'{longitude},{latitude}', self.search_apikey)
+        return parse_organisation(self.fetch(SEARCH_API_SERVER, params).json())
+
+
+class AsyncMapClient:
+    def __init__(self, static_apikey: str, search_apikey: str, geocode_apikey: str,
+                 map_server: str = MAP_API_SERVER, session: 'aiohttp.ClientSession' = None,
+                 limit: int = 100, gazetteer=None, reverse_geocoder=None, http_cache=None) -> None:
+        if aiohttp is None:
+            raise ImportError('AsyncMapClient requires aiohttp')
+        self.static_apikey = static_apikey
+        self.search_apikey = search_apikey
+        self.geocode_apikey = geocode_apikey
+        self.map_server = map_server
+        self.session = session
+        self.limit = limit
+        self.gazetteer = gazetteer
+        self.reverse_geocoder = reverse_geocoder
+        self.http_cache = http_cache
+        self.flights = AsyncSingleFlight()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'AsyncMapClient':
+        kwargs.setdefault('map_server', os.getenv('MAP_API_SERVER', MAP_API_SERVER))
+        return cls(os.getenv('STATIC_APIKEY'), os.getenv('SEARCH_APIKEY'), os.getenv('GEOCODE_APIKEY'), **kwargs)
+
+    async def __aenter__(self) -> 'AsyncMapClient':
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit))
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def fetch(self, url: str, params: dict) -> bytes:
+        params = {name: str(value) for name, value in params.items() if value is not None}
+        return await self.flights.do(request_key(url, params), self._get, url, params)
+
+    async def _get(self, url: str, params: dict) -> bytes:
+        try:
+            if self.http_cache:
+                status, body = await self.http_cache.fetch_async(self.session, url, params)
+            else:
+                async with self.session.get(url, params=params) as response:
+                    status, body = response.status, await response.read()
+        except aiohttp.ClientError as error:
+            raise MapClientError(str(error)) from error
+        if status >= 400:
+            raise MapClientError(f'{url} responded with {status}')
+        return body
+
+    async def map_image(self, view: ViewKey, size: str = '450,450', scale: float = 1.0) -> bytes:
+        return await self.fetch(self.map_server, map_params(view, self.static_apikey, size, scale))
+
+    async def search(self, text: str) -> Place:
+        place = self.gazetteer.lookup(text) if self.gazetteer else None
+        if place is not None:
+            return place
+        body = await self.fetch(SEARCH_API_SERVER, search_params(text, self.search_apikey))
+        return parse_place(json.loads(body))
+
+    async def search_places(self, text: str, results: int = SEARCH_PAGE_SIZE, skip: int = 0) -> list[Place]:
+        if self.gazetteer and self.gazetteer.search(text, limit=1):
+            return self.gazetteer.search(text, limit=results, offset=skip)
+        body = await self.fetch(SEARCH_API_SERVER, search_params(text, self.search_apikey, results, skip))
+        return parse_places(json.loads(body))
+
+    async def suggest(self, text: str, results: int = 5) -> list[Place]:
+        places = self.gazetteer.search(text, limit=results, prefix=True) if self.gazetteer else []
+        if places:
+            return places
+        body = await self.fetch(SEARCH_API_SERVER, search_params(text, self.search_apikey, results))
+        return parse_places(json.loads(body))
+
+    async def postal_code(self, address_line: str) -> str:
+        body = await self.fetch(GEOCODER_API_SERVER, geocode_params(address_line, self.geocode_apikey))
+        return parse_postal_code(json.loads(body))
+
+    async def reverse_geocode(self, latitude: float, longitude: float) -> AddressDetails:
+        place = local_address(self.reverse_geocoder, latitude, longitude)
+        if place is not None:
+            return place.address
+        body = await self.fetch(GEOCODER_API_SERVER, geocode_params(f'{longitude},{latitude}', self.geocode_apikey))
+        return parse_address(json.loads(body))
+
+    async def nearest_organisation(self, latitude: float, longitude: float, text: str = None) -> Organisation | None:
+        organisation = local_organisation(self.reverse_geocoder, latitude, longitude)
+        if organisation is not None:
+            return organisation
+        params = organisation_params(latitude, longitude, text or f'{longitude},{latitude}', self.search_apikey)
+        return parse_organisation(json.loads(await self.fetch(SEARCH_API_SERVER, params)))
@@ -0,0 +1,155 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import math
+import os
+import sqlite3
+import threading
+
+from map_client import MapClient
+from projection import TILE_SIZE, to_pixels
+from tile_pack import TilePack
+from view_key import ViewKey
+from viewport import Viewport
+
+
+MBTILES_PATH = 'cache/map.mbtiles'
+MBTILES_DARK_PATH = 'cache/map-dark.mbtiles'
+TILE_PACK_PATH = 'cache/map.pack'
+# Deeper than this past the stored zooms, whole tiles would be decoded at thousands of pixels per side.
+MAX_OVERZOOM = 2
+
+
+@dataclass(frozen=True)
+class Piece:
+    x: float
+    y: float
+    width: float
+    height: float
+    data: bytes | memoryview
+
+
+class MapSource(ABC):
+    url = ''
+
+    @abstractmethod
+    def pieces(self, view: ViewKey, viewport: Viewport) -> list[Piece]:
+        ...
+
+
+class StaticMapSource(MapSource):
+    def __init__(self, client: MapClient) -> None:
+        self.client = client
+        self.url = client.map_server
+
+    def pieces(self, view: ViewKey, viewport: Viewport) -> list[Piece]:
+        pieces = []
+        latitude, longitude = view.center
+        for part in viewport.split(longitude, latitude, view.zoom):
+            part_view = view.replace(latitude=part.latitude, longitude=part.longitude, viewport=None)
+            data = self.client.map_image(part_view, size=part.size, scale=viewport.scale)
+            pieces.append(Piece(part.x, part.y, part.width, part.height, data))
+        return pieces
+
+
+class MBTiles:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self.metadata = dict(self.connection.execute('SELECT name, value FROM metadata'))
+        self.min_zoom, self.max_zoom = self.connection.execute(
+            'SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles').fetchone()
+
+    def tile(self, zoom: int, column: int, row: int) -> bytes | None:
+        with self.lock:
+            found = self.connection.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                (zoom, column, 2 ** zoom - 1 - row)).fetchone()
+        return found[0] if found else None
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class TileSource(MapSource):
+    fallback: MapSource | None = None
+
+    @abstractmethod
+    def zoom_range(self, theme: bool) -> tuple[int, int] | None:
+        ...
+
+    @abstractmethod
+    def tile(self, zoom: int, column: int, row: int, theme: bool) -> bytes | memoryview | None:
+        ...
+
+    def pieces(self, view: ViewKey, viewport: Viewport) -> list[Piece]:
+        zooms = self.zoom_range(view.theme)
+        # Below the lowest stored zoom a tile would shrink under a pixel, so the view is not covered at all.
+        if zooms is None or view.zoom < zooms[0] or view.zoom - zooms[1] > MAX_OVERZOOM:
+            return self.fallback_pieces(view, viewport)
+        zoom = min(view.zoom, zooms[1])
+        tile_size = TILE_SIZE * 2 ** (view.zoom - zoom)
+        # Tilesets are spherical mercator, unlike the ellipsoidal projection of the static api.
+        latitude, longitude = view.center
+        center_x, center_y = to_pixels(longitude, latitude, view.zoom, eccentricity=0)
+        left, top = center_x - viewport.width / 2, center_y - viewport.height / 2
+        columns = range(math.floor(left / tile_size), math.ceil((left + viewport.width) / tile_size))
+        rows = range(max(math.floor(top / tile_size), 0),
+                     min(math.ceil((top + viewport.height) / tile_size), 2 ** zoom))
+
+        pieces = []
+        for row in rows:
+            for column in columns:
+                data = self.tile(zoom, column % 2 ** zoom, row, view.theme)
+                if data is None:
+                    # A view that leaves the downloaded region is loaded whole rather than as a patchwork.
+                    return self.fallback_pieces(view, viewport)
+                pieces.append(Piece(column * tile_size - left, row * tile_size - top, tile_size, tile_size, data))
+        return pieces
+
+    def fallback_pieces(self, view: ViewKey, viewport: Viewport) -> list[Piece]:
+        return self.fallback.pieces(view, viewport) if self.fallback else []
+
+
+class MBTilesSource(TileSource):
+    def __init__(self, path: str, dark_path: str = None, fallback: MapSource = None) -> None:
+        # Jobs are limited per host, and with a fallback any of them may go to the network.
+        self.url = fallback.url if fallback else f'file://{os.path.abspath(path)}'
+        self.fallback = fallback
+        self.tilesets = {False: MBTiles(path)}
+        self.tilesets[True] = MBTiles(dark_path) if dark_path else self.tilesets[False]
+
+    def zoom_range(self, theme: bool) -> tuple[int, int] | None:
+        tileset = self.tilesets[theme]
+        return None if tileset.max_zoom is None else (tileset.min_zoom, tileset.max_zoom)
+
+    def tile(self, zoom: int, column: int, row: int, theme: bool) -> bytes | None:
+        return self.tilesets[theme].tile(zoom, column, row)
+
+
+class TilePackSource(TileSource):
+    def __init__(self, path: str, fallback: MapSource = None) -> None:
+        self.url = fallback.url if fallback else f'file://{os.path.abspath(path)}'
+        self.fallback = fallback
+        self.pack = TilePack(path)
+
+    def zoom_range(self, theme: bool) -> tuple[int, int] | None:
+        return self.pack.zoom_range(theme) or self.pack.zoom_range(not theme)
+
+    def tile(self, zoom: int, column: int, row: int, theme: bool) -> memoryview | None:
+        if self.pack.zoom_range(theme) is None:
+            theme = not theme
+        return self.pack.tile(zoom, column, row, theme)
+
+
+def open_map_source(client: MapClient) -> MapSource:
+    online = StaticMapSource(client)
+    pack_path = os.getenv('TILE_PACK_PATH', TILE_PACK_PATH)
+    if os.path.exists(pack_path):
+        return TilePackSource(pack_path, fallback=online)
+    path = os.getenv('MBTILES_PATH', MBTILES_PATH)
+    if not os.path.exists(path):
+        return online
+    dark_path = os.getenv('MBTILES_DARK_PATH', MBTILES_DARK_PATH)
+    return MBTilesSource(path, dark_path=dark_path if os.path.exists(dark_path) else None, fallback=online)
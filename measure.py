@@ -0,0 +1,99 @@
+from dotenv import load_dotenv
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from point_layer import read_csv
+from projection import MEAN_EARTH_RADIUS
+
+
+def distances(latitudes1, longitudes1, latitudes2, longitudes2) -> np.ndarray:
+    phi1, phi2 = np.radians(latitudes1), np.radians(latitudes2)
+    a = (np.sin((phi2 - phi1) / 2) ** 2 +
+         np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(np.subtract(longitudes2, longitudes1)) / 2) ** 2)
+    return 2 * MEAN_EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def half_angle_differences(angles, other_angles) -> np.ndarray:
+    # sin((b - a) / 2) for every pair from per-point sines and cosines, without a trigonometric call per pair.
+    half, other_half = np.radians(angles) / 2, np.radians(other_angles) / 2
+    return np.outer(np.cos(half), np.sin(other_half)) - np.outer(np.sin(half), np.cos(other_half))
+
+
+def distance_matrix(latitudes, longitudes, other_latitudes=None, other_longitudes=None) -> np.ndarray:
+    latitudes, longitudes = np.asarray(latitudes, dtype=np.float64), np.asarray(longitudes, dtype=np.float64)
+    if other_latitudes is None:
+        other_latitudes, other_longitudes = latitudes, longitudes
+    other_latitudes = np.asarray(other_latitudes, dtype=np.float64)
+    other_longitudes = np.asarray(other_longitudes, dtype=np.float64)
+    a = half_angle_differences(latitudes, other_latitudes)
+    a *= a
+    d_lam = half_angle_differences(longitudes, other_longitudes)
+    d_lam *= d_lam
+    d_lam *= np.outer(np.cos(np.radians(latitudes)), np.cos(np.radians(other_latitudes)))
+    a += d_lam
+    np.minimum(a, 1.0, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * MEAN_EARTH_RADIUS
+    return a
+
+
+def path_length(latitudes, longitudes) -> float:
+    latitudes, longitudes = np.asarray(latitudes, dtype=np.float64), np.asarray(longitudes, dtype=np.float64)
+    return float(distances(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:]).sum())
+
+
+def polygon_area(latitudes, longitudes) -> float:
+    # Spherical polygon area from the signed sum over edges (Chamberlain and Duquette, 2007).
+    if len(latitudes) < 3:
+        return 0.0
+    phi = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lam = np.radians(np.asarray(longitudes, dtype=np.float64))
+    d_lam = (np.roll(lam, -1) - lam + np.pi) % (2 * np.pi) - np.pi
+    return float(abs(np.sum(d_lam * (2 + np.sin(phi) + np.sin(np.roll(phi, -1))))) * MEAN_EARTH_RADIUS ** 2 / 2)
+
+
+def format_distance(metres: float) -> str:
+    return f'{metres:.0f} м' if metres < 1000 else f'{metres / 1000:.2f} км'
+
+
+def format_area(square_metres: float) -> str:
+    if square_metres < 10_000:
+        return f'{square_metres:.0f} м²'
+    if square_metres < 1_000_000:
+        return f'{square_metres / 10_000:.2f} га'
+    return f'{square_metres / 1_000_000:.2f} км²'
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Geodesic distances, path lengths and areas')
+    commands = parser.add_subparsers(dest='command', required=True)
+    path_command = commands.add_parser('path', help='length and enclosed area of a path')
+    path_command.add_argument('coordinates', nargs='+', type=float, help='latitude longitude ...')
+    matrix_command = commands.add_parser('matrix', help='nearest neighbours from the full distance matrix')
+    matrix_command.add_argument('csv', help='file with latitude,longitude columns')
+    args = parser.parse_args()
+
+    if args.command == 'path':
+        latitudes, longitudes = args.coordinates[0::2], args.coordinates[1::2]
+        print(f'length {format_distance(path_length(latitudes, longitudes))}, '
+              f'area {format_area(polygon_area(latitudes, longitudes))}')
+        return
+
+    latitudes, longitudes, _ = read_csv(args.csv)
+    start = time.perf_counter()
+    matrix = distance_matrix(latitudes, longitudes)
+    elapsed = time.perf_counter() - start
+    np.fill_diagonal(matrix, np.inf)
+    nearest = matrix.min(axis=1)
+    print(f'{len(latitudes)}x{len(latitudes)} matrix in {elapsed * 1000:.1f} ms', file=sys.stderr)
+    print(f'nearest neighbour: median {format_distance(float(np.median(nearest)))}, '
+          f'max {format_distance(float(nearest.max()))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from projection import ECCENTRICITY, MAX_LATITUDE, world_size
+
+
+POINT_LAYER_PATH = 'cache/points.csv'
+# Points are stored as fixed-point world coordinates: 2 ** 30 units per axis is a quarter pixel at zoom 20.
+INDEX_BITS = 30
+MAX_ZOOM = INDEX_BITS - 10
+CLUSTER_BITS = 6
+CLUSTER_RATIO = 0.5
+MAX_SYMBOLS = 2000
+
+
+def project(latitudes: np.ndarray, longitudes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    phi = np.radians(np.clip(np.asarray(latitudes, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    e_sin = ECCENTRICITY * np.sin(phi)
+    y = np.log(np.tan(np.pi / 4 + phi / 2) * ((1 - e_sin) / (1 + e_sin)) ** (ECCENTRICITY / 2))
+    longitudes = (np.asarray(longitudes, dtype=np.float64) + 180) % 360 - 180
+    size = 2 ** INDEX_BITS
+    x = np.clip((longitudes / 360 + 0.5) * size, 0, size - 1)
+    y = np.clip((0.5 - y / (2 * np.pi)) * size, 0, size - 1)
+    return x.astype(np.uint32), y.astype(np.uint32)
+
+
+def spread_bits(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.uint64)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | values << np.uint64(shift)) & np.uint64(mask)
+    return values
+
+
+def morton(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return spread_bits(x) | spread_bits(y) << np.uint64(1)
+
+
+@dataclass(frozen=True)
+class Level:
+    keys: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    counts: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def query(self, left: int, top: int, right: int, bottom: int) -> np.ndarray:
+        # Z-order keys make every quadtree cell a contiguous run, so a few cells around the box
+        # bound the candidates with a handful of binary searches.
+        extent = max(right - left, bottom - top, 1)
+        shift = min(max(math.ceil(math.log2(extent / 8)), 0), INDEX_BITS)
+        columns = np.arange(left >> shift, (right - 1 >> shift) + 1, dtype=np.uint64)
+        rows = np.arange(top >> shift, (bottom - 1 >> shift) + 1, dtype=np.uint64)
+        cells = morton(*np.meshgrid(columns, rows)).ravel() << np.uint64(2 * shift)
+        starts = np.searchsorted(self.keys, cells)
+        stops = np.searchsorted(self.keys, cells + np.uint64(1 << 2 * shift))
+        candidates = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops) if stop > start]
+                                    or [np.empty(0, dtype=np.int64)])
+        x, y = self.x[candidates], self.y[candidates]
+        return candidates[(x >= left) & (x < right) & (y >= top) & (y < bottom)]
+
+    def find(self, left: int, top: int, right: int, bottom: int) -> tuple[np.ndarray, np.ndarray]:
+        size = 2 ** INDEX_BITS
+        top, bottom = max(top, 0), min(bottom, size)
+        found, xs = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for wrap in range(left // size, (right - 1) // size + 1) if top < bottom else ():
+            shift = wrap * size
+            indices = self.query(max(left - shift, 0), top, min(right - shift, size), bottom)
+            found.append(indices)
+            xs.append(self.x[indices] + np.int64(shift))
+        return np.concatenate(found), np.concatenate(xs)
+
+
+def cluster(points: Level, zoom: int, bits: int = CLUSTER_BITS) -> Level:
+    shift = np.uint64(2 * (INDEX_BITS - 8 - zoom + bits))
+    cells = points.keys >> shift
+    starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+    sizes = np.diff(np.append(starts, len(cells)))
+    x = (np.add.reduceat(points.x, starts, dtype=np.uint64) // sizes).astype(np.uint32)
+    y = (np.add.reduceat(points.y, starts, dtype=np.uint64) // sizes).astype(np.uint32)
+    # The mean of a cell stays inside it, so the cluster keys keep the z-order of the points.
+    return Level(morton(x, y), x, y, np.add.reduceat(points.counts, starts))
+
+
+def cluster_visible(xs: np.ndarray, ys: np.ndarray,
+                    counts: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    size = 2 ** CLUSTER_BITS
+    cells = np.floor(xs / size).astype(np.int64) << 32 | np.floor(ys / size).astype(np.int64)
+    _, inverse = np.unique(cells, return_inverse=True)
+    totals = np.bincount(inverse, weights=counts)
+    return (np.bincount(inverse, weights=xs * counts) / totals, np.bincount(inverse, weights=ys * counts) / totals,
+            totals.astype(np.uint32))
+
+
+class PointLayer:
+    def __init__(self, x: np.ndarray, y: np.ndarray) -> None:
+        x, y = np.asarray(x, dtype=np.uint32), np.asarray(y, dtype=np.uint32)
+        keys = morton(x, y)
+        order = np.argsort(keys, kind='stable')
+        self.points = Level(keys[order], x[order], y[order], np.ones(len(keys), dtype=np.uint32))
+        self.levels = {}
+        for zoom in range(MAX_ZOOM + 1):
+            level = cluster(self.points, zoom)
+            if len(level) > CLUSTER_RATIO * len(self.points):
+                break
+            self.levels[zoom] = level
+
+    @classmethod
+    def from_coordinates(cls, latitudes: np.ndarray, longitudes: np.ndarray) -> 'PointLayer':
+        return cls(*project(latitudes, longitudes))
+
+    @classmethod
+    def from_file(cls, path: str) -> 'PointLayer':
+        if path.endswith('.npz'):
+            with np.load(path) as arrays:
+                return cls(arrays['x'], arrays['y'])
+        read = read_geojson if path.endswith(('.geojson', '.json')) else read_csv
+        latitudes, longitudes, _ = read(path)
+        return cls.from_coordinates(latitudes, longitudes)
+
+    def save(self, path: str) -> None:
+        np.savez(path, x=self.points.x, y=self.points.y)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def visible(self, zoom: int, left: float, top: float, width: float,
+                height: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        level = self.levels.get(zoom, self.points)
+        units = 2 ** INDEX_BITS / world_size(zoom)
+        found, x = level.find(math.floor(left * units), math.floor(top * units), math.ceil((left + width) * units),
+                              math.ceil((top + height) * units))
+        xs, ys, counts = x / units - left, level.y[found] / units - top, level.counts[found]
+        if len(xs) > MAX_SYMBOLS:
+            # Dense spots past the last cluster level are grouped on screen instead.
+            return cluster_visible(xs, ys, counts)
+        return xs, ys, counts
+
+
+def read_csv(path: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    latitudes, longitudes, weights = [], [], []
+    with open(path, encoding='utf-8', newline='') as file:
+        for record in csv.DictReader(file):
+            try:
+                latitude, longitude = float(record['latitude']), float(record['longitude'])
+                weight = float(record.get('weight') or 1)
+            except (KeyError, TypeError, ValueError):
+                continue
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+            weights.append(weight)
+    return np.array(latitudes), np.array(longitudes), np.array(weights)
+
+
+def read_geojson(path: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    with open(path, encoding='utf-8') as file:
+        collection = json.load(file)
+    coordinates, weights = [], []
+    for feature in collection.get('features', []):
+        geometry = feature.get('geometry') or {}
+        weight = float((feature.get('properties') or {}).get('weight', 1))
+        if geometry.get('type') == 'Point':
+            coordinates.append(geometry['coordinates'][:2])
+            weights.append(weight)
+        elif geometry.get('type') == 'MultiPoint':
+            coordinates.extend(point[:2] for point in geometry['coordinates'])
+            weights.extend(weight for _ in geometry['coordinates'])
+    coordinates = np.array(coordinates, dtype=np.float64).reshape(-1, 2)
+    return coordinates[:, 1], coordinates[:, 0], np.array(weights)
+
+
+def open_point_layer() -> PointLayer | None:
+    path = os.getenv('POINT_LAYER_PATH', POINT_LAYER_PATH)
+    return PointLayer.from_file(path) if os.path.exists(path) else None
+
+
+def random_points(count: int, centers: int = 50) -> tuple[np.ndarray, np.ndarray]:
+    generator = np.random.default_rng(0)
+    latitudes = generator.uniform(-60, 70, centers)
+    longitudes = generator.uniform(-180, 180, centers)
+    spread = generator.uniform(0.05, 2, centers)
+    which = generator.integers(0, centers, count)
+    return (latitudes[which] + generator.normal(0, 1, count) * spread[which],
+            longitudes[which] + generator.normal(0, 1, count) * spread[which])
+
+
+def benchmark(layer: PointLayer, frames: int, width: int, height: int) -> None:
+    random.seed(0)
+    latencies, drawn = [], []
+    for _ in range(frames):
+        index = random.randrange(len(layer))
+        zoom = random.randint(1, MAX_ZOOM)
+        units = 2 ** INDEX_BITS / world_size(zoom)
+        x, y = layer.points.x[index] / units, layer.points.y[index] / units
+        start = time.perf_counter()
+        found = layer.visible(zoom, x - width / 2, y - height / 2, width, height)
+        latencies.append((time.perf_counter() - start) * 1000)
+        drawn.append(len(found[0]))
+    latencies.sort()
+    print(f'{frames} views: median {statistics.median(latencies):.2f} ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)]:.2f} ms, max {latencies[-1]:.2f} ms, '
+          f'up to {max(drawn)} symbols per view')
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Point layers over CSV or GeoJSON files')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_command = commands.add_parser('build', help='convert CSV or GeoJSON points to a .npz layer')
+    build_command.add_argument('input')
+    build_command.add_argument('output')
+    bench_command = commands.add_parser('bench', help='time viewport queries at random views')
+    bench_command.add_argument('input', nargs='?', default=os.getenv('POINT_LAYER_PATH', POINT_LAYER_PATH))
+    bench_command.add_argument('--random', type=int, help='use this many generated points instead of a file')
+    bench_command.add_argument('--frames', type=int, default=1000)
+    bench_command.add_argument('--size', default='650,450', help='viewport width,height')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'bench' and args.random:
+        layer = PointLayer.from_coordinates(*random_points(args.random))
+    else:
+        layer = PointLayer.from_file(args.input)
+    print(f'{len(layer)} points, {len(layer.levels)} cluster levels in {time.perf_counter() - start:.2f} s',
+          file=sys.stderr)
+    if args.command == 'build':
+        layer.save(args.output)
+    else:
+        benchmark(layer, args.frames, *map(int, args.size.split(',')))
+
+
+if __name__ == '__main__':
+    main()
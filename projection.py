@@ -0,0 +1,53 @@
+import math
+
+
+TILE_SIZE = 256
+EARTH_RADIUS = 6378137
+MEAN_EARTH_RADIUS = 6371008.8
+ECCENTRICITY = 0.0818191908426
+MAX_LATITUDE = 85.08405903
+
+
+def world_size(zoom: float) -> float:
+    return TILE_SIZE * 2 ** zoom
+
+
+def to_pixels(longitude: float, latitude: float, zoom: float,
+              eccentricity: float = ECCENTRICITY) -> tuple[float, float]:
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    phi = math.radians(latitude)
+    e_sin = eccentricity * math.sin(phi)
+    y = math.log(math.tan(math.pi / 4 + phi / 2) * ((1 - e_sin) / (1 + e_sin)) ** (eccentricity / 2))
+    size = world_size(zoom)
+    return (longitude / 360 + 0.5) * size, (0.5 - y / (2 * math.pi)) * size
+
+
+def from_pixels(x: float, y: float, zoom: float, eccentricity: float = ECCENTRICITY) -> tuple[float, float]:
+    size = world_size(zoom)
+    longitude = (x / size - 0.5) * 360
+    t = math.exp(-(0.5 - y / size) * 2 * math.pi)
+    phi = math.pi / 2 - 2 * math.atan(t)
+    for _ in range(10):
+        e_sin = eccentricity * math.sin(phi)
+        new_phi = math.pi / 2 - 2 * math.atan(t * ((1 - e_sin) / (1 + e_sin)) ** (eccentricity / 2))
+        if abs(new_phi - phi) < 1e-12:
+            phi = new_phi
+            break
+        phi = new_phi
+    return normalize_longitude(longitude), math.degrees(phi)
+
+
+def normalize_longitude(longitude: float) -> float:
+    return (longitude + 180) % 360 - 180 if not -180 <= longitude <= 180 else longitude
+
+
+def offset(longitude: float, latitude: float, zoom: float, dx: float, dy: float) -> tuple[float, float]:
+    x, y = to_pixels(longitude, latitude, zoom)
+    return from_pixels(x + dx, y + dy, zoom)
+
+
+def haversine(latitude1: float, longitude1: float, latitude2: float, longitude2: float) -> float:
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(longitude2 - longitude1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * MEAN_EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
@@ -0,0 +1,97 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from dotenv import load_dotenv
+import argparse
+import json
+import os
+
+import requests
+
+from disk_cache import DiskCache
+from http_cache import HttpCache, cache_key
+from map_client import MAP_API_SERVER
+from singleflight import SingleFlight
+
+
+PASSED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Expires', 'X-Cache')
+
+
+class MapProxy:
+    def __init__(self, cache: DiskCache, upstream: str = MAP_API_SERVER, apikey: str = None,
+                 max_age: float = 7 * 24 * 3600) -> None:
+        self.http_cache = HttpCache(cache, shared=True, default_lifetime=max_age)
+        self.upstream = upstream
+        self.apikey = apikey
+        self.session = requests.Session()
+        self.flights = SingleFlight()
+
+    def get(self, params: dict) -> requests.Response:
+        key = cache_key(self.upstream, params)
+        params = dict(params, apikey=self.apikey or params.get('apikey'))
+        return self.flights.do(key, self.http_cache.fetch, self.session, self.upstream, params, key)
+
+    def stats(self) -> dict:
+        stats = self.http_cache.stats()
+        # Fresh hits also run inside a flight, so upstream requests are counted where the cache makes them.
+        return dict(stats, upstream=stats['misses'] + stats['revalidated'], coalesced=self.flights.saved)
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path == '/stats':
+            self.send(200, 'application/json', json.dumps(self.server.proxy.stats()).encode())
+            return
+        if url.path.rstrip('/') != '/v1':
+            self.send(404, 'text/plain', b'not found')
+            return
+
+        try:
+            response = self.server.proxy.get(dict(parse_qsl(url.query)))
+        except requests.RequestException as error:
+            self.send(502, 'text/plain', str(error).encode())
+            return
+        headers = {name: response.headers[name] for name in PASSED_HEADERS if name in response.headers}
+        content_type = response.headers.get('Content-Type', 'application/octet-stream')
+        etag = response.headers.get('ETag')
+        if response.ok and etag and etag in self.headers.get('If-None-Match', ''):
+            self.send(304, content_type, b'', headers)
+            return
+        self.send(response.status_code, content_type, response.content, headers)
+
+    def send(self, status: int, content_type: str, body: bytes, headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Caching proxy for the static maps api')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache', default='cache/proxy.sqlite3')
+    parser.add_argument('--cache-size', type=int, default=1024, help='cache size limit in MiB')
+    parser.add_argument('--upstream', default=MAP_API_SERVER)
+    parser.add_argument('--max-age', type=float, default=7 * 24 * 3600,
+                        help='lifetime in seconds for upstream responses without caching headers')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), ProxyHandler)
+    server.proxy = MapProxy(DiskCache(args.cache, max_bytes=args.cache_size * 2 ** 20), upstream=args.upstream,
+                            apikey=os.getenv('STATIC_APIKEY'), max_age=args.max_age)
+    purged = server.proxy.http_cache.purge()
+    print(f'map proxy on http://{args.host}:{args.port}/v1, {purged} expired entries purged')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import threading
+import time
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class QuotaLimiter:
+    def __init__(self, rate: float, burst: int = 1, quota: int = None) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.quota = quota
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                if self.quota is not None and self.used >= self.quota:
+                    raise QuotaExceeded(f'request quota of {self.quota} is spent')
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.used += 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    @property
+    def remaining(self) -> int | None:
+        with self.lock:
+            return None if self.quota is None else max(self.quota - self.used, 0)
@@ -0,0 +1,192 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from typing import Iterator
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+from map_client import MapClient, MapClientError
+from map_source import MBTILES_DARK_PATH, MBTILES_PATH
+from projection import TILE_SIZE, from_pixels, to_pixels
+from quota import QuotaExceeded, QuotaLimiter
+from view_key import ViewKey
+
+
+ESTIMATED_TILE_BYTES = 20 * 1024
+
+
+def parse_bbox(text: str) -> tuple[float, float, float, float]:
+    west, south, east, north = map(float, text.split(','))
+    if west >= east or south >= north:
+        raise ValueError('bbox is west,south,east,north')
+    return west, south, east, north
+
+
+def parse_zooms(text: str) -> range:
+    first, _, last = text.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+
+def tile_range(bbox: tuple[float, float, float, float], zoom: int) -> tuple[range, range]:
+    west, south, east, north = bbox
+    left, top = to_pixels(west, north, zoom, eccentricity=0)
+    right, bottom = to_pixels(east, south, zoom, eccentricity=0)
+    last = 2 ** zoom - 1
+    return (range(max(int(left // TILE_SIZE), 0), min(int(right // TILE_SIZE), last) + 1),
+            range(max(int(top // TILE_SIZE), 0), min(int(bottom // TILE_SIZE), last) + 1))
+
+
+def region_tiles(bbox: tuple[float, float, float, float], zooms: range) -> Iterator[tuple[int, int, int]]:
+    for zoom in zooms:
+        columns, rows = tile_range(bbox, zoom)
+        for row in rows:
+            for column in columns:
+                yield zoom, column, row
+
+
+def tile_center(zoom: int, column: int, row: int) -> tuple[float, float]:
+    return from_pixels((column + 0.5) * TILE_SIZE, (row + 0.5) * TILE_SIZE, zoom, eccentricity=0)
+
+
+def stored_tiles(path: str) -> tuple[set[tuple[int, int, int]], float]:
+    # Read-only, so that an estimate never leaves an empty tileset behind for the app to pick up.
+    if not os.path.exists(path):
+        return set(), ESTIMATED_TILE_BYTES
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        stored = {(zoom, column, 2 ** zoom - 1 - row) for zoom, column, row in connection.execute(
+            'SELECT zoom_level, tile_column, tile_row FROM tiles')}
+        size = connection.execute('SELECT AVG(LENGTH(tile_data)) FROM tiles').fetchone()[0]
+    finally:
+        connection.close()
+    return stored, size or ESTIMATED_TILE_BYTES
+
+
+class MBTilesWriter:
+    def __init__(self, path: str, name: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+                                              tile_data BLOB);
+            CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+        ''')
+        self.connection.executemany('INSERT OR IGNORE INTO metadata VALUES (?, ?)',
+                                    [('name', name), ('format', 'png'), ('type', 'baselayer')])
+        self.connection.commit()
+
+    def put(self, tile: tuple[int, int, int], data: bytes) -> None:
+        zoom, column, row = tile
+        self.connection.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)',
+                                (zoom, column, 2 ** zoom - 1 - row, data))
+
+    def finish(self, bbox: tuple[float, float, float, float]) -> None:
+        min_zoom, max_zoom = self.connection.execute('SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles').fetchone()
+        self.connection.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?)',
+                                    [('minzoom', str(min_zoom)), ('maxzoom', str(max_zoom)),
+                                     ('bounds', ','.join(map(str, bbox)))])
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+
+def download_tile(client: MapClient, limiter: QuotaLimiter, theme: bool, tile: tuple[int, int, int],
+                  scale: float) -> bytes:
+    longitude, latitude = tile_center(*tile)
+    limiter.acquire()
+    view = ViewKey(latitude=latitude, longitude=longitude, zoom=tile[0], theme=theme)
+    return client.map_image(view, size=f'{TILE_SIZE},{TILE_SIZE}', scale=scale)
+
+
+def download_region(client: MapClient, writer: MBTilesWriter, tiles: list[tuple[int, int, int]], theme: bool,
+                    limiter: QuotaLimiter, workers: int = 4, scale: float = 1.0) -> tuple[int, int, int]:
+    downloaded = failed = size = 0
+    pending = {}
+    tiles = iter(tiles)
+    exhausted = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            for tile in tiles if exhausted is None else ():
+                pending[pool.submit(download_tile, client, limiter, theme, tile, scale)] = tile
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile = pending.pop(future)
+                try:
+                    data = future.result()
+                except QuotaExceeded as error:
+                    exhausted = error
+                    continue
+                except MapClientError as error:
+                    failed += 1
+                    print(f'tile {tile}: {error}', file=sys.stderr)
+                    continue
+                writer.put(tile, data)
+                downloaded += 1
+                size += len(data)
+                if downloaded % 100 == 0:
+                    writer.connection.commit()
+                    print(f'{downloaded} tiles, {size / 2 ** 20:.1f} MiB', file=sys.stderr)
+    if exhausted is not None:
+        print(f'stopped: {exhausted}; run again later to resume', file=sys.stderr)
+    return downloaded, failed, size
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Download a region into MBTiles files for offline use')
+    parser.add_argument('--bbox', type=parse_bbox, required=True, help='west,south,east,north')
+    parser.add_argument('--zoom', type=parse_zooms, default=parse_zooms('10-17'), help='for example 10-17')
+    parser.add_argument('--themes', default='light,dark')
+    parser.add_argument('--output', default=os.getenv('MBTILES_PATH', MBTILES_PATH))
+    parser.add_argument('--dark-output', default=os.getenv('MBTILES_DARK_PATH', MBTILES_DARK_PATH))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=5, help='requests per second')
+    parser.add_argument('--quota', type=int, help='maximum number of requests for this run')
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--dry-run', action='store_true', help='only print the estimate')
+    args = parser.parse_args()
+
+    tiles = list(region_tiles(args.bbox, args.zoom))
+    targets = []
+    for theme in args.themes.split(','):
+        theme = theme.strip()
+        path = args.dark_output if theme == 'dark' else args.output
+        stored, tile_bytes = stored_tiles(path)
+        missing = [tile for tile in tiles if tile not in stored]
+        estimate = len(missing) * tile_bytes
+        print(f'{theme}: {len(tiles)} tiles at zoom {args.zoom.start}-{args.zoom.stop - 1}, '
+              f'{len(tiles) - len(missing)} stored, {len(missing)} requests, ~{estimate / 2 ** 20:.1f} MiB')
+        targets.append((theme, path, missing))
+    requests_needed = sum(len(missing) for _, _, missing in targets)
+    print(f'total: {requests_needed} requests, ~{requests_needed / args.rate / 60:.1f} min at {args.rate:g}/s')
+    if args.dry_run:
+        return
+
+    client = MapClient.from_env()
+    limiter = QuotaLimiter(args.rate, burst=args.workers, quota=args.quota)
+    for theme, path, missing in targets:
+        start = time.perf_counter()
+        writer = MBTilesWriter(path, f'{theme} map')
+        downloaded, failed, size = download_region(client, writer, missing, theme == 'dark', limiter, args.workers,
+                                                   args.scale)
+        writer.finish(args.bbox)
+        writer.close()
+        print(f'{theme}: {downloaded} tiles ({size / 2 ** 20:.1f} MiB) '
+              f'in {time.perf_counter() - start:.1f} s, {failed} failed')
+        if limiter.remaining == 0:
+            break
+
+
+if __name__ == '__main__':
+    main()
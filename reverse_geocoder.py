@@ -0,0 +1,115 @@
+from dotenv import load_dotenv
+import argparse
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from gazetteer import GAZETTEER_PATH, Gazetteer
+from map_client import AddressDetails, Place
+
+
+EARTH_RADIUS = 6371008.8
+
+
+def to_unit_vectors(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    phi = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lam = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_phi = np.cos(phi)
+    return np.column_stack((cos_phi * np.cos(lam), cos_phi * np.sin(lam), np.sin(phi)))
+
+
+def chord_to_metres(chord: np.ndarray) -> np.ndarray:
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def metres_to_chord(metres: float) -> float:
+    return 2 * np.sin(min(metres / EARTH_RADIUS, np.pi) / 2)
+
+
+class ReverseGeocoder:
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray, places: list[Place]) -> None:
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.places = places
+        self.tree = cKDTree(to_unit_vectors(self.latitudes, self.longitudes))
+
+    @classmethod
+    def from_places(cls, places: list[Place]) -> 'ReverseGeocoder':
+        return cls([place.latitude for place in places], [place.longitude for place in places], places)
+
+    @classmethod
+    def from_gazetteer(cls, gazetteer: Gazetteer) -> 'ReverseGeocoder':
+        with gazetteer.lock:
+            rows = gazetteer.connection.execute(
+                'SELECT name, address, postal_code, latitude, longitude FROM places').fetchall()
+        places = [Place(latitude=latitude, longitude=longitude, name=name or '',
+                        address=AddressDetails(address_line=address, postal_code=postal_code or None))
+                  for name, address, postal_code, latitude, longitude in rows]
+        return cls.from_places(places)
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def query(self, latitudes: np.ndarray, longitudes: np.ndarray,
+              max_distance: float = np.inf) -> tuple[np.ndarray, np.ndarray]:
+        upper_bound = metres_to_chord(max_distance) if np.isfinite(max_distance) else np.inf
+        chords, indices = self.tree.query(to_unit_vectors(latitudes, longitudes), distance_upper_bound=upper_bound)
+        missing = indices >= len(self.places)
+        indices = np.where(missing, -1, indices)
+        distances = np.where(missing, np.inf, chord_to_metres(np.where(missing, 0, chords)))
+        return indices, distances
+
+    def nearest(self, latitude: float, longitude: float,
+                max_distance: float = np.inf) -> tuple[Place, float] | None:
+        if not self.places:
+            return None
+        indices, distances = self.query([latitude], [longitude], max_distance)
+        if indices[0] < 0:
+            return None
+        return self.places[indices[0]], float(distances[0])
+
+
+def open_reverse_geocoder(gazetteer: Gazetteer | None) -> ReverseGeocoder | None:
+    if gazetteer is None or not len(gazetteer):
+        return None
+    return ReverseGeocoder.from_gazetteer(gazetteer)
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Offline reverse geocoding over the gazetteer places')
+    parser.add_argument('--db', default=os.getenv('GAZETTEER_PATH', GAZETTEER_PATH))
+    parser.add_argument('--max-distance', type=float, default=np.inf, help='metres')
+    parser.add_argument('--csv', help='file with latitude,longitude columns; results go to stdout')
+    parser.add_argument('coordinates', nargs='*', type=float, help='latitude longitude')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    geocoder = ReverseGeocoder.from_gazetteer(Gazetteer(args.db))
+    print(f'{len(geocoder)} places indexed in {time.perf_counter() - start:.2f} s', file=sys.stderr)
+
+    if args.csv:
+        with open(args.csv, encoding='utf-8', newline='') as file:
+            records = list(csv.DictReader(file))
+        latitudes = np.array([float(record['latitude']) for record in records])
+        longitudes = np.array([float(record['longitude']) for record in records])
+    else:
+        latitudes, longitudes = np.array(args.coordinates[0::2]), np.array(args.coordinates[1::2])
+
+    start = time.perf_counter()
+    indices, distances = geocoder.query(latitudes, longitudes, args.max_distance)
+    elapsed = time.perf_counter() - start
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['latitude', 'longitude', 'address', 'distance'])
+    for latitude, longitude, index, distance in zip(latitudes, longitudes, indices, distances):
+        address = geocoder.places[index].get_title() if index >= 0 else ''
+        writer.writerow([latitude, longitude, address, f'{distance:.1f}'])
+    print(f'{len(indices)} queries in {elapsed * 1e6 / max(len(indices), 1):.1f} us each', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Callable
+from urllib.parse import urlsplit
+import threading
+import time
+
+
+class Priority(IntEnum):
+    VIEW = 0
+    USER = 1
+    BACKGROUND = 2
+    PREFETCH = 3
+
+
+@dataclass
+class Job:
+    priority: Priority
+    host: str
+    fn: Callable
+    args: tuple
+    kwargs: dict
+    future: Future = field(default_factory=Future)
+    submitted: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class ClassStats:
+    queued: int = 0
+    running: int = 0
+    completed: int = 0
+    cancelled: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        started = self.completed + self.running
+        return self.total_wait / started if started else 0.0
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+class RequestScheduler:
+    def __init__(self, workers: int = 6, host_limit: int = 4, host_limits: dict[str, int] = None) -> None:
+        self.host_limit = host_limit
+        self.host_limits = host_limits or {}
+        self.queues = {priority: deque() for priority in Priority}
+        self.class_stats = {priority: ClassStats() for priority in Priority}
+        self.active_hosts = {}
+        self.condition = threading.Condition()
+        self.running = True
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, priority: Priority, host: str, fn: Callable, *args, **kwargs) -> Future:
+        job = Job(priority=priority, host=host, fn=fn, args=args, kwargs=kwargs)
+        with self.condition:
+            # A new view drops queued speculative work; background jobs such as layer loading are still wanted.
+            preempted = self._preempt(Priority.PREFETCH) if priority == Priority.VIEW else []
+            self.queues[priority].append(job)
+            self.class_stats[priority].queued += 1
+            self.condition.notify()
+        self._cancel(preempted)
+        return job.future
+
+    def cancel(self, priority: Priority) -> int:
+        with self.condition:
+            preempted = self._preempt(priority)
+        self._cancel(preempted)
+        return len(preempted)
+
+    def stats(self) -> dict[Priority, ClassStats]:
+        with self.condition:
+            return {priority: ClassStats(**vars(stats)) for priority, stats in self.class_stats.items()}
+
+    def shutdown(self) -> None:
+        with self.condition:
+            self.running = False
+            preempted = [job for priority in Priority for job in self._preempt(priority)]
+            self.condition.notify_all()
+        self._cancel(preempted)
+
+    def _preempt(self, priority: Priority) -> list[Job]:
+        queue = self.queues[priority]
+        preempted = list(queue)
+        queue.clear()
+        self.class_stats[priority].queued -= len(preempted)
+        self.class_stats[priority].cancelled += len(preempted)
+        return preempted
+
+    @staticmethod
+    def _cancel(jobs: list[Job]) -> None:
+        # Done callbacks run inside cancel() and may submit again, so they must not run under the lock.
+        for job in jobs:
+            job.future.cancel()
+
+    def _limit(self, host: str) -> int:
+        return self.host_limits.get(host, self.host_limit)
+
+    def _next_job(self) -> Job | None:
+        for priority in Priority:
+            queue = self.queues[priority]
+            for job in queue:
+                if self.active_hosts.get(job.host, 0) < self._limit(job.host):
+                    queue.remove(job)
+                    return job
+        return None
+
+    def _work(self) -> None:
+        while True:
+            with self.condition:
+                job = self._next_job()
+                while job is None and self.running:
+                    self.condition.wait()
+                    job = self._next_job()
+                if job is None:
+                    return
+                stats = self.class_stats[job.priority]
+                wait = time.monotonic() - job.submitted
+                stats.queued -= 1
+                stats.running += 1
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+                self.active_hosts[job.host] = self.active_hosts.get(job.host, 0) + 1
+
+            started = job.future.set_running_or_notify_cancel()
+            if started:
+                try:
+                    job.future.set_result(job.fn(*job.args, **job.kwargs))
+                except BaseException as error:
+                    job.future.set_exception(error)
+
+            with self.condition:
+                stats.running -= 1
+                if started:
+                    stats.completed += 1
+                else:
+                    stats.cancelled += 1
+                self.active_hosts[job.host] -= 1
+                self.condition.notify_all()
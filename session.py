@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+import json
+import os
+
+
+SESSION_DIR = 'cache'
+
+
+@dataclass
+class Session:
+    map: dict | None
+    address: dict | None
+    viewport: dict | None
+    window: tuple[int, int] | None
+    image: bytes | None
+    marker: tuple[float, float] | None = None
+
+
+def save_session(session: Session, directory: str = SESSION_DIR) -> None:
+    os.makedirs(directory, exist_ok=True)
+    state = {'map': session.map, 'address': session.address, 'viewport': session.viewport, 'window': session.window,
+             'marker': session.marker}
+    image_path = os.path.join(directory, 'session.png')
+    if session.image:
+        with open(image_path, 'wb') as file:
+            file.write(session.image)
+    elif os.path.exists(image_path):
+        os.remove(image_path)
+    with open(os.path.join(directory, 'session.json'), 'w', encoding='utf-8') as file:
+        json.dump(state, file, ensure_ascii=False)
+
+
+def load_session(directory: str = SESSION_DIR) -> Session | None:
+    try:
+        with open(os.path.join(directory, 'session.json'), encoding='utf-8') as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    image = None
+    image_path = os.path.join(directory, 'session.png')
+    if os.path.exists(image_path):
+        with open(image_path, 'rb') as file:
+            image = file.read()
+    window = tuple(state['window']) if state.get('window') else None
+    marker = tuple(state['marker']) if state.get('marker') else None
+    return Session(map=state.get('map'), address=state.get('address'), viewport=state.get('viewport'),
+                   window=window, image=image, marker=marker)
@@ -0,0 +1,57 @@
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+import asyncio
+import threading
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.saved = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+                self.executed += 1
+            else:
+                self.saved += 1
+
+        if leader:
+            try:
+                call.set_result(fn(*args, **kwargs))
+            except BaseException as error:
+                call.set_exception(error)
+            finally:
+                with self.lock:
+                    del self.calls[key]
+        return call.result()
+
+    def in_flight(self) -> int:
+        with self.lock:
+            return len(self.calls)
+
+
+class AsyncSingleFlight:
+    def __init__(self) -> None:
+        self.calls = {}
+        self.executed = 0
+        self.saved = 0
+
+    async def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        call = self.calls.get(key)
+        if call is None:
+            call = self.calls[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            call.add_done_callback(lambda _: self.calls.pop(key, None))
+            self.executed += 1
+        else:
+            self.saved += 1
+        return await asyncio.shield(call)
+
+
+def request_key(url: str, params: dict = None) -> tuple:
+    return url, tuple(sorted((name, str(value)) for name, value in (params or {}).items()))
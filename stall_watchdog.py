@@ -0,0 +1,74 @@
+from collections import Counter
+from typing import Callable
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+
+logger = logging.getLogger(__name__)
+SOURCE_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def handler_name(frame, ignore: tuple[str, ...] = ()) -> str:
+    frames = [frame for frame, _ in traceback.walk_stack(frame)][::-1]
+    for frame in frames:
+        name, filename = frame.f_code.co_qualname, frame.f_code.co_filename
+        if name != '<module>' and name not in ignore and filename.startswith(SOURCE_ROOT + os.sep):
+            return name
+    return frames[-1].f_code.co_qualname if frames else '?'
+
+
+class StallWatchdog:
+    def __init__(self, post: Callable[[Callable], None], threshold: float = 0.2, interval: float = 0.01,
+                 ignore: tuple[str, ...] = ()) -> None:
+        self.post = post
+        self.threshold = threshold
+        self.interval = interval
+        self.ignore = ignore
+        self.main_thread = threading.main_thread().ident
+        self.answered = threading.Event()
+        self.stopped = threading.Event()
+        self.stalls = Counter()
+        self.longest = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._watch, name='stall-watchdog', daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.answered.set()
+
+    def _watch(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.answered.clear()
+            sent = time.monotonic()
+            self.post(self.answered.set)
+            if self.answered.wait(self.threshold):
+                continue
+            frame = sys._current_frames().get(self.main_thread)
+            if frame is None:
+                continue
+            handler = handler_name(frame, self.ignore)
+            stack = traceback.extract_stack(frame)
+            del frame
+            self.answered.wait()
+            if self.stopped.is_set():
+                return
+            self._report(time.monotonic() - sent, handler, stack)
+
+    def _report(self, duration: float, handler: str, stack: traceback.StackSummary) -> None:
+        with self.lock:
+            self.stalls[handler] += 1
+            self.longest[handler] = max(self.longest.get(handler, 0.0), duration)
+            count = self.stalls[handler]
+        logger.warning('event loop blocked for %.0f ms in %s (stall #%d there)\n%s', duration * 1000, handler, count,
+                       ''.join(traceback.format_list(stack)).rstrip())
+
+    def stats(self) -> dict[str, tuple[int, float]]:
+        with self.lock:
+            return {handler: (count, self.longest[handler]) for handler, count in self.stalls.most_common()}
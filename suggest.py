@@ -0,0 +1,60 @@
+from typing import Any, Callable
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+class TrieNode:
+    __slots__ = ('children', 'results', 'complete')
+
+    def __init__(self) -> None:
+        self.children = {}
+        self.results = None
+        self.complete = False
+
+
+class PrefixCache:
+    def __init__(self, limit: int, text_of: Callable[[Any], str], max_entries: int = 5000) -> None:
+        self.limit = limit
+        self.text_of = text_of
+        self.max_entries = max_entries
+        self.root = TrieNode()
+        self.entries = 0
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    def put(self, text: str, results: list) -> None:
+        if self.entries >= self.max_entries:
+            self.root = TrieNode()
+            self.entries = 0
+        node = self.root
+        for char in normalize(text):
+            node = node.children.setdefault(char, TrieNode())
+        if node.results is None:
+            self.entries += 1
+        node.results = list(results)
+        node.complete = len(results) < self.limit
+
+    def get(self, text: str) -> tuple[list, bool] | None:
+        text = normalize(text)
+        node, ancestor = self.root, None
+        for char in text:
+            if node.results is not None:
+                ancestor = node
+            node = node.children.get(char)
+            if node is None:
+                break
+        if node is not None and node.results is not None:
+            self.hits += 1
+            return node.results, True
+        if ancestor is None:
+            self.misses += 1
+            return None
+
+        self.prefix_hits += 1
+        words = text.split()
+        results = [result for result in ancestor.results
+                   if all(word in normalize(self.text_of(result)) for word in words)]
+        return results, ancestor.complete and bool(results)
@@ -0,0 +1,176 @@
+from array import array
+from bisect import bisect_left
+from functools import partial
+from typing import Callable, Iterator
+import argparse
+import mmap
+import os
+import random
+import sqlite3
+import statistics
+import struct
+import sys
+import time
+
+
+MAGIC = b'MTPK'
+VERSION = 1
+HEADER = struct.Struct('<4sHBBBB6xQ')
+NO_ZOOM = 255
+
+
+def tile_key(zoom: int, column: int, row: int, theme: bool) -> int:
+    return zoom << 50 | column << 26 | row << 1 | int(theme)
+
+
+class TilePack:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, *zooms, count = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} tile pack')
+        self.zooms = {False: tuple(zooms[:2]), True: tuple(zooms[2:])}
+        view = memoryview(self.data)
+        start = HEADER.size
+        self.keys = view[start:start + 8 * count].cast('Q')
+        self.offsets = view[start + 8 * count:start + 16 * count].cast('Q')
+        self.lengths = view[start + 16 * count:start + 20 * count].cast('I')
+        self.view = view
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def zoom_range(self, theme: bool) -> tuple[int, int] | None:
+        zooms = self.zooms[theme]
+        return None if zooms[0] == NO_ZOOM else zooms
+
+    def find(self, key: int) -> int | None:
+        index = bisect_left(self.keys, key)
+        return index if index < len(self.keys) and self.keys[index] == key else None
+
+    def blob(self, index: int) -> memoryview:
+        offset = self.offsets[index]
+        return self.view[offset:offset + self.lengths[index]]
+
+    def tile(self, zoom: int, column: int, row: int, theme: bool) -> memoryview | None:
+        index = self.find(tile_key(zoom, column, row, theme))
+        return None if index is None else self.blob(index)
+
+    def items(self) -> Iterator[tuple[int, int]]:
+        return zip(self.keys, range(len(self.keys)))
+
+    def close(self) -> None:
+        for view in (self.keys, self.offsets, self.lengths, self.view):
+            view.release()
+        self.data.close()
+
+
+def write_pack(path: str, tiles: dict[int, Callable[[], bytes]]) -> int:
+    keys = sorted(tiles)
+    zooms = []
+    for theme in (False, True):
+        theme_zooms = [key >> 50 for key in keys if key & 1 == theme]
+        zooms += [min(theme_zooms), max(theme_zooms)] if theme_zooms else [NO_ZOOM, NO_ZOOM]
+
+    offsets, lengths = array('Q'), array('I')
+    index_size = 20 * len(keys)
+    data_start = HEADER.size + index_size + -index_size % 8
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, *zooms, len(keys)))
+        file.seek(data_start)
+        for key in keys:
+            data = tiles[key]()
+            offsets.append(file.tell())
+            lengths.append(len(data))
+            file.write(data)
+        file.seek(HEADER.size)
+        for values in (array('Q', keys), offsets, lengths):
+            values.tofile(file)
+    os.replace(temporary, path)
+    return len(keys)
+
+
+def mbtiles_tiles(path: str, theme: bool) -> dict[int, Callable[[], bytes]]:
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+
+    def read(rowid: int) -> bytes:
+        return connection.execute('SELECT tile_data FROM tiles WHERE rowid = ?', (rowid,)).fetchone()[0]
+
+    return {tile_key(zoom, column, 2 ** zoom - 1 - row, theme): partial(read, rowid)
+            for rowid, zoom, column, row in connection.execute(
+                'SELECT rowid, zoom_level, tile_column, tile_row FROM tiles')}
+
+
+def pack_tiles(pack: TilePack) -> dict[int, Callable[[], bytes]]:
+    return {key: partial(pack.blob, index) for key, index in pack.items()}
+
+
+def benchmark(pack_path: str, mbtiles_path: str, theme: bool, reads: int) -> None:
+    connection = sqlite3.connect(f'file:{mbtiles_path}?mode=ro', uri=True)
+    tiles = connection.execute('SELECT zoom_level, tile_column, tile_row FROM tiles').fetchall()
+    sample = [random.choice(tiles) for _ in range(reads)]
+    pack = TilePack(pack_path)
+
+    def read_sqlite(zoom: int, column: int, row: int) -> bytes:
+        return connection.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+            (zoom, column, row)).fetchone()[0]
+
+    def read_pack(zoom: int, column: int, row: int) -> memoryview:
+        return pack.tile(zoom, column, 2 ** zoom - 1 - row, theme)
+
+    for name, read in (('sqlite', read_sqlite), ('pack', read_pack)):
+        latencies = []
+        for tile in sample:
+            start = time.perf_counter()
+            read(*tile)
+            latencies.append((time.perf_counter() - start) * 1e6)
+        latencies.sort()
+        print(f'{name:>6}: median {statistics.median(latencies):.1f} us, '
+              f'p99 {latencies[int(len(latencies) * 0.99)]:.1f} us, mean {statistics.fmean(latencies):.1f} us')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Single-file memory-mapped tile packs')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_command = commands.add_parser('build', help='pack MBTiles files')
+    build_command.add_argument('output')
+    build_command.add_argument('--mbtiles', help='light theme tiles')
+    build_command.add_argument('--dark-mbtiles', help='dark theme tiles')
+    merge_command = commands.add_parser('merge', help='merge packs; later packs win on duplicate tiles')
+    merge_command.add_argument('output')
+    merge_command.add_argument('packs', nargs='+')
+    bench_command = commands.add_parser('bench', help='compare random reads against an MBTiles file')
+    bench_command.add_argument('pack')
+    bench_command.add_argument('mbtiles')
+    bench_command.add_argument('--dark', action='store_true', help='the MBTiles file holds the dark theme')
+    bench_command.add_argument('--reads', type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        benchmark(args.pack, args.mbtiles, args.dark, args.reads)
+        return
+
+    start = time.perf_counter()
+    tiles = {}
+    packs = []
+    if args.command == 'build':
+        for path, theme in ((args.mbtiles, False), (args.dark_mbtiles, True)):
+            if path:
+                tiles.update(mbtiles_tiles(path, theme))
+    else:
+        for path in args.packs:
+            packs.append(TilePack(path))
+            tiles.update(pack_tiles(packs[-1]))
+    count = write_pack(args.output, tiles)
+    for pack in packs:
+        pack.close()
+    print(f'{count} tiles, {os.path.getsize(args.output) / 2 ** 20:.1f} MiB in {args.output} '
+          f'({time.perf_counter() - start:.2f} s)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
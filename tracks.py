@@ -0,0 +1,242 @@
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+from point_layer import INDEX_BITS, MAX_ZOOM, project
+from projection import world_size
+
+
+TRACKS_PATH = 'cache/tracks'
+TOLERANCE = 1.0
+CHUNK_SIZE = 256
+
+
+def segment_distances(x: np.ndarray, y: np.ndarray, start_x: np.ndarray, start_y: np.ndarray,
+                      end_x: np.ndarray, end_y: np.ndarray) -> np.ndarray:
+    dx, dy = end_x - start_x, end_y - start_y
+    length = dx * dx + dy * dy
+    t = np.clip(((x - start_x) * dx + (y - start_y) * dy) / np.where(length > 0, length, 1), 0, 1)
+    return np.hypot(x - start_x - t * dx, y - start_y - t * dy)
+
+
+def importance(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    # Douglas-Peucker that splits every open segment of one recursion depth in a single vectorized pass.
+    # A vertex gets the distance at which it was kept, capped by its parent so that levels nest.
+    weights = np.zeros(len(x))
+    weights[[0, -1]] = np.inf
+    starts, ends, caps = np.array([0]), np.array([len(x) - 1]), np.array([np.inf])
+    while len(starts):
+        open_segments = ends - starts > 1
+        starts, ends, caps = starts[open_segments], ends[open_segments], caps[open_segments]
+        if not len(starts):
+            break
+        lengths = ends - starts - 1
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        owner = np.repeat(np.arange(len(starts)), lengths)
+        vertices = np.arange(len(owner)) - offsets[owner] + starts[owner] + 1
+        distances = segment_distances(x[vertices], y[vertices], x[starts[owner]], y[starts[owner]],
+                                      x[ends[owner]], y[ends[owner]])
+        farthest = np.maximum.reduceat(distances, offsets)
+        owners, first = np.unique(owner[distances == farthest[owner]], return_index=True)
+        split = vertices[np.flatnonzero(distances == farthest[owner])[first]]
+        keep = farthest[owners] >= tolerance
+        owners, split = owners[keep], split[keep]
+        weights[split] = np.minimum(farthest[owners], caps[owners])
+        starts = np.concatenate((starts[owners], split))
+        ends = np.concatenate((split, ends[owners]))
+        caps = np.tile(weights[split], 2)
+    return weights
+
+
+@dataclass(frozen=True)
+class TrackLevel:
+    vertices: np.ndarray
+    left: np.ndarray
+    top: np.ndarray
+    right: np.ndarray
+    bottom: np.ndarray
+
+
+def track_level(x: np.ndarray, y: np.ndarray, vertices: np.ndarray) -> TrackLevel:
+    starts = np.arange(0, max(len(vertices) - 1, 1), CHUNK_SIZE)
+    last = np.minimum(starts + CHUNK_SIZE, len(vertices) - 1)
+    x, y = x[vertices], y[vertices]
+    return TrackLevel(vertices, np.minimum(np.minimum.reduceat(x, starts), x[last]),
+                      np.minimum(np.minimum.reduceat(y, starts), y[last]),
+                      np.maximum(np.maximum.reduceat(x, starts), x[last]),
+                      np.maximum(np.maximum.reduceat(y, starts), y[last]))
+
+
+class Track:
+    def __init__(self, name: str, x: np.ndarray, y: np.ndarray) -> None:
+        self.name = name
+        self.x, self.y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        units = [2 ** INDEX_BITS / world_size(zoom) for zoom in range(MAX_ZOOM + 1)]
+        weights = importance(self.x, self.y, TOLERANCE * units[-1])
+        self.levels = [track_level(self.x, self.y, np.flatnonzero(weights >= TOLERANCE * unit)) for unit in units]
+
+    @classmethod
+    def from_coordinates(cls, name: str, latitudes: np.ndarray, longitudes: np.ndarray) -> 'Track':
+        x, y = project(latitudes, longitudes)
+        return cls(name, x, y)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def visible(self, zoom: int, left: float, top: float, width: float, height: float) -> list[np.ndarray]:
+        level = self.levels[zoom]
+        if len(level.vertices) < 2:
+            return []
+        units = 2 ** INDEX_BITS / world_size(zoom)
+        box_left, box_top = left * units, top * units
+        box_right, box_bottom = (left + width) * units, (top + height) * units
+        lines = []
+        for wrap in range(math.floor(box_left / 2 ** INDEX_BITS), math.floor(box_right / 2 ** INDEX_BITS) + 1):
+            shift = wrap * 2 ** INDEX_BITS
+            chunks = np.flatnonzero((level.right >= box_left - shift) & (level.left <= box_right - shift) &
+                                    (level.bottom >= box_top) & (level.top <= box_bottom))
+            segments = (chunks[:, None] * CHUNK_SIZE + np.arange(CHUNK_SIZE)).ravel()
+            segments = segments[segments < len(level.vertices) - 1]
+            x0, x1 = self.x[level.vertices[segments]], self.x[level.vertices[segments + 1]]
+            y0, y1 = self.y[level.vertices[segments]], self.y[level.vertices[segments + 1]]
+            segments = segments[(np.maximum(x0, x1) >= box_left - shift) & (np.minimum(x0, x1) <= box_right - shift) &
+                                (np.maximum(y0, y1) >= box_top) & (np.minimum(y0, y1) <= box_bottom)]
+            for run in np.split(segments, np.flatnonzero(np.diff(segments) != 1) + 1) if len(segments) else ():
+                vertices = level.vertices[run[0]:run[-1] + 2]
+                lines.append(np.column_stack(((self.x[vertices] + shift) / units - left,
+                                              self.y[vertices] / units - top)))
+        return lines
+
+
+class TrackLayer:
+    def __init__(self, tracks: list[Track]) -> None:
+        self.tracks = tracks
+
+    @classmethod
+    def from_paths(cls, paths: list[str]) -> 'TrackLayer':
+        tracks = []
+        for path in paths:
+            read = read_gpx if path.endswith('.gpx') else read_geojson
+            tracks += [Track.from_coordinates(name, latitudes, longitudes)
+                       for name, latitudes, longitudes in read(path) if len(latitudes) > 1]
+        return cls(tracks)
+
+    def __len__(self) -> int:
+        return sum(len(track) for track in self.tracks)
+
+    def visible(self, zoom: int, left: float, top: float, width: float, height: float) -> list[np.ndarray]:
+        return [line for track in self.tracks for line in track.visible(zoom, left, top, width, height)]
+
+
+def read_gpx(path: str):
+    root = ElementTree.parse(path).getroot()
+    namespace = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+    name = os.path.splitext(os.path.basename(path))[0]
+    for track in root.iter(f'{namespace}trk'):
+        title = track.findtext(f'{namespace}name') or name
+        for segment in track.iter(f'{namespace}trkseg'):
+            points = segment.findall(f'{namespace}trkpt')
+            yield (title, np.array([float(point.get('lat')) for point in points]),
+                   np.array([float(point.get('lon')) for point in points]))
+    for route in root.iter(f'{namespace}rte'):
+        points = route.findall(f'{namespace}rtept')
+        yield (route.findtext(f'{namespace}name') or name, np.array([float(point.get('lat')) for point in points]),
+               np.array([float(point.get('lon')) for point in points]))
+
+
+def read_geojson(path: str):
+    with open(path, encoding='utf-8') as file:
+        collection = json.load(file)
+    name = os.path.splitext(os.path.basename(path))[0]
+    for feature in collection.get('features', []):
+        geometry = feature.get('geometry') or {}
+        title = (feature.get('properties') or {}).get('name') or name
+        if geometry.get('type') == 'LineString':
+            lines = [geometry['coordinates']]
+        elif geometry.get('type') == 'MultiLineString':
+            lines = geometry['coordinates']
+        else:
+            continue
+        for line in lines:
+            coordinates = np.array([point[:2] for point in line], dtype=np.float64).reshape(-1, 2)
+            yield title, coordinates[:, 1], coordinates[:, 0]
+
+
+def track_paths(path: str) -> list[str]:
+    if not os.path.isdir(path):
+        return [path] if os.path.exists(path) else []
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.endswith(('.gpx', '.geojson', '.json')))
+
+
+def open_tracks() -> TrackLayer | None:
+    paths = track_paths(os.getenv('TRACKS_PATH', TRACKS_PATH))
+    return TrackLayer.from_paths(paths) if paths else None
+
+
+def random_track(count: int) -> tuple[np.ndarray, np.ndarray]:
+    generator = np.random.default_rng(0)
+    # Straight runs with occasional turns and a few metres of gps noise, roughly like a vehicle in a city.
+    turns = np.where(generator.random(count) < 0.005, generator.choice([-np.pi / 2, np.pi / 2], count), 0)
+    heading = np.cumsum(turns + generator.normal(0, 0.01, count))
+    step = generator.uniform(5e-5, 1.5e-4, count)
+    noise = generator.normal(0, 3e-5, (2, count))
+    return (55.75 + np.cumsum(step * np.sin(heading)) + noise[0],
+            37.6 + np.cumsum(step * np.cos(heading)) / 0.56 + noise[1])
+
+
+def benchmark(layer: TrackLayer, frames: int, width: int, height: int) -> None:
+    random.seed(0)
+    latencies, drawn = [], []
+    for _ in range(frames):
+        track = random.choice(layer.tracks)
+        index = random.randrange(len(track))
+        zoom = random.randint(1, MAX_ZOOM)
+        units = 2 ** INDEX_BITS / world_size(zoom)
+        x, y = track.x[index] / units - width / 2, track.y[index] / units - height / 2
+        start = time.perf_counter()
+        lines = layer.visible(zoom, x, y, width, height)
+        latencies.append((time.perf_counter() - start) * 1000)
+        drawn.append(sum(len(line) for line in lines))
+    latencies.sort()
+    print(f'{frames} views: median {statistics.median(latencies):.2f} ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)]:.2f} ms, max {latencies[-1]:.2f} ms, '
+          f'up to {max(drawn)} vertices per view')
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Simplify GPX or GeoJSON tracks and time viewport queries')
+    parser.add_argument('paths', nargs='*', default=track_paths(os.getenv('TRACKS_PATH', TRACKS_PATH)))
+    parser.add_argument('--random', type=int, help='use a generated track with this many vertices')
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--size', default='650,450', help='viewport width,height')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.random:
+        layer = TrackLayer([Track.from_coordinates('random', *random_track(args.random))])
+    else:
+        layer = TrackLayer.from_paths(args.paths)
+    print(f'{len(layer.tracks)} tracks, {len(layer)} vertices simplified in {time.perf_counter() - start:.2f} s',
+          file=sys.stderr)
+    for track in layer.tracks:
+        print(f'{track.name}: ' + ', '.join(f'z{zoom} {len(level.vertices)}'
+                                            for zoom, level in enumerate(track.levels) if zoom % 4 == 0),
+              file=sys.stderr)
+    if layer.tracks:
+        benchmark(layer, args.frames, *map(int, args.size.split(',')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+from projection import MAX_LATITUDE, from_pixels, normalize_longitude, to_pixels, world_size
+
+
+PIXEL_QUANTUM = 0.25
+
+
+class ViewKey:
+    __slots__ = ('latitude', 'longitude', 'zoom', 'theme', 'point', 'viewport', 'cell', 'center', '_hash')
+
+    def __init__(self, latitude: float, longitude: float, zoom: int, theme: bool = False, point: str = None,
+                 viewport=None) -> None:
+        zoom = int(zoom)
+        latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, float(latitude)))
+        longitude = normalize_longitude(float(longitude))
+        x, y = to_pixels(longitude, latitude, zoom)
+        columns = round(world_size(zoom) / PIXEL_QUANTUM)
+        cell = round(x / PIXEL_QUANTUM) % columns, round(y / PIXEL_QUANTUM)
+        center_longitude, center_latitude = from_pixels(cell[0] * PIXEL_QUANTUM, cell[1] * PIXEL_QUANTUM, zoom)
+        for name, value in (('latitude', latitude), ('longitude', longitude), ('zoom', zoom), ('theme', bool(theme)),
+                            ('point', point or None), ('viewport', viewport), ('cell', cell),
+                            ('center', (round(center_latitude, 7), round(center_longitude, 7)))):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_hash', hash(self._identity()))
+
+    def _identity(self) -> tuple:
+        return self.cell, self.zoom, self.theme, self.point, self.viewport
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ViewKey):
+            return NotImplemented
+        return self._hash == other._hash and self._identity() == other._identity()
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __repr__(self) -> str:
+        return (f'ViewKey(latitude={self.latitude}, longitude={self.longitude}, zoom={self.zoom}, '
+                f'theme={self.theme}, point={self.point!r}, viewport={self.viewport!r})')
+
+    def replace(self, **changes) -> 'ViewKey':
+        fields = self.to_dict()
+        fields['viewport'] = self.viewport
+        fields.update(changes)
+        return ViewKey(**fields)
+
+    def to_dict(self) -> dict:
+        return {'latitude': self.latitude, 'longitude': self.longitude, 'zoom': self.zoom, 'theme': self.theme,
+                'point': self.point}
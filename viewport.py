@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+import math
+
+from projection import offset
+
+
+MAX_WIDTH, MAX_HEIGHT = 650, 450
+MIN_SCALE, MAX_SCALE = 1.0, 4.0
+
+
+@dataclass(frozen=True)
+class MapPart:
+    longitude: float
+    latitude: float
+    x: int
+    y: int
+    width: int
+    height: int
+
+    @property
+    def size(self) -> str:
+        return f'{self.width},{self.height}'
+
+
+@dataclass(frozen=True)
+class Viewport:
+    width: int
+    height: int
+    scale: float
+
+    @classmethod
+    def from_widget(cls, widget) -> 'Viewport':
+        scale = min(max(widget.devicePixelRatioF(), MIN_SCALE), MAX_SCALE)
+        return cls(width=widget.width(), height=widget.height(), scale=round(scale, 1))
+
+    @property
+    def pixel_width(self) -> int:
+        return round(self.width * self.scale)
+
+    @property
+    def pixel_height(self) -> int:
+        return round(self.height * self.scale)
+
+    def split(self, longitude: float, latitude: float, zoom: int) -> list[MapPart]:
+        columns = _spans(self.width, MAX_WIDTH)
+        rows = _spans(self.height, MAX_HEIGHT)
+        parts = []
+        for y, height in rows:
+            for x, width in columns:
+                dx = x + width / 2 - self.width / 2
+                dy = y + height / 2 - self.height / 2
+                part_longitude, part_latitude = offset(longitude, latitude, zoom, dx, dy)
+                parts.append(MapPart(longitude=part_longitude, latitude=part_latitude,
+                                     x=x, y=y, width=width, height=height))
+        return parts
+
+
+def _spans(length: int, limit: int) -> list[tuple[int, int]]:
+    count = max(1, math.ceil(length / limit))
+    bounds = [round(length * i / count) for i in range(count + 1)]
+    return [(start, end - start) for start, end in zip(bounds, bounds[1:])]